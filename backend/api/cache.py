@@ -0,0 +1,117 @@
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.response import Response
+
+# Области версий. Общая версия catalog входит в каждый ключ и меняется
+# при правке тегов, ингредиентов и пользователей, которые видны
+# в рецептах. Остальные области описывают, от каких рецептов зависит
+# ответ: вся лента, рецепты автора, рецепты с тегом или один рецепт.
+CATALOG = 'catalog'
+FEED = 'feed'
+
+
+def author_scope(author_id):
+    return f'author:{author_id}'
+
+
+def tag_scope(slug):
+    return f'tag:{slug}'
+
+
+def recipe_scope(recipe_id):
+    return f'recipe:{recipe_id}'
+
+
+class ResponseCacheVersions:
+    """
+    Версии областей кеша ответов. Версия это случайный токен, а не
+    счётчик: incr есть не у всех бэкендов, а потерянный при вытеснении
+    токен просто заменяется новым, и старые ключи больше не читаются.
+    Смена версии откладывается до коммита транзакции, иначе параллельный
+    запрос мог бы сохранить старые данные под новой версией.
+    """
+
+    prefix = 'response_cache_version:'
+
+    def get_many(self, scopes):
+        keys = [self.prefix + scope for scope in scopes]
+        versions = cache.get_many(keys)
+        missing = [key for key in keys if key not in versions]
+        if missing:
+            for key in missing:
+                cache.add(key, uuid.uuid4().hex, None)
+            versions.update(cache.get_many(missing))
+        return [versions.get(key, '') for key in keys]
+
+    def bump(self, scopes):
+        keys = [self.prefix + scope for scope in set(scopes)]
+        transaction.on_commit(lambda: cache.set_many(
+            {key: uuid.uuid4().hex for key in keys}, None
+        ))
+
+
+response_cache_versions = ResponseCacheVersions()
+
+
+class AnonymousResponseCacheMixin:
+    """
+    Кеш ответов list и retrieve для анонимных GET запросов, одинаковых
+    для всех анонимов. Ключ строится из хоста, пути, нормализованных
+    параметров из cache_query_params и версий областей, от которых
+    зависит ответ. Запросы с другими параметрами не кешируются.
+    В кеше хранится response.data, рендер выполняется заново.
+    Вьюсет с примесью определяет get_cache_scopes(request, params):
+    список областей ответа или None, если ответ не кешируется.
+    """
+
+    cache_query_params = ()
+
+    def get_cache_key(self, request):
+        params = {}
+        for name, values in request.query_params.lists():
+            if name not in self.cache_query_params:
+                return None
+            params[name] = sorted(set(values))
+        scopes = self.get_cache_scopes(request, params)
+        if scopes is None:
+            return None
+        versions = response_cache_versions.get_many([CATALOG, *scopes])
+        key = '|'.join([
+            request.scheme,
+            request.get_host(),
+            request.path,
+            repr(sorted(params.items())),
+            *versions,
+        ])
+        return 'response_cache:' + hashlib.blake2b(
+            key.encode(), digest_size=16
+        ).hexdigest()
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        if (
+            not settings.RESPONSE_CACHE_ENABLED
+            or request.user.is_authenticated
+        ):
+            return handler(request, *args, **kwargs)
+        key = self.get_cache_key(request)
+        if key is None:
+            return handler(request, *args, **kwargs)
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, settings.RESPONSE_CACHE_TIMEOUT)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            super().retrieve, request, *args, **kwargs
+        )
@@ -1,8 +1,10 @@
 from django_filters.rest_framework import (BooleanFilter, CharFilter,
                                            FilterSet,
                                            ModelMultipleChoiceFilter)
+from rest_framework.filters import SearchFilter
 
 from recipes.models import Ingredient, Recipe, Tag
+from recipes.search import search_recipes
 
 
 class IngredientFilter(FilterSet):
@@ -45,3 +47,17 @@ class RecipeFilter(FilterSet):
 
     def filter_tags(self, queryset, name, value):
         return queryset.filter(tags__slug__in=value)
+
+
+class RecipeSearchFilter(SearchFilter):
+    """
+    Поиск рецептов по параметру search: полнотекстовый поиск по названию,
+    ингредиентам и описанию с ранжированием и триграммным поиском
+    по названию на случай опечаток.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '').strip()
+        if not query:
+            return queryset
+        return search_recipes(queryset, query)
@@ -0,0 +1,239 @@
+import contextvars
+import json
+import logging
+import random
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from backend.metrics import (DB_DURATION, DB_QUERIES, REQUEST_COUNT,
+                             REQUEST_LATENCY, RESPONSE_SIZE)
+
+logger = logging.getLogger('api.timing')
+
+TIMING_HEADER = 'HTTP_X_REQUEST_TIMING'
+
+# Замеры текущего запроса или None, если инструментирование выключено.
+current_timings = contextvars.ContextVar('current_timings', default=None)
+
+
+class RequestTimings:
+    """
+    Замеры одного запроса: время и число запросов к базе данных,
+    повторяющиеся запросы и время сериализации. Вызывается как
+    обёртка connection.execute_wrapper.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+            self.statements[sql] += 1
+
+    def repeated_statements(self, threshold):
+        """
+        Одинаковые SQL с разными параметрами, выполненные threshold
+        и больше раз: так обычно выглядит N+1.
+        """
+
+        return [
+            {'sql': sql, 'count': count}
+            for sql, count in self.statements.most_common()
+            if count >= threshold
+        ]
+
+
+class TimedSerializerMixin:
+    """
+    Добавляет время to_representation к замерам текущего запроса.
+    Считается только внешний сериализатор, вложенные уже входят в его
+    время.
+    """
+
+    def to_representation(self, instance):
+        timings = current_timings.get()
+        if timings is None:
+            return super().to_representation(instance)
+        timings.serializer_depth += 1
+        started = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            timings.serializer_depth -= 1
+            if not timings.serializer_depth:
+                timings.serializer_time += time.perf_counter() - started
+
+
+def is_staff_request(request):
+    """
+    Проверяет права до вызова view: пользователь берётся из сессии или
+    аутентификацией DRF по заголовку. JWT аутентификация находит
+    пользователя в UserCache, поэтому повторная проверка во view
+    почти ничего не стоит.
+    """
+
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        authenticators = api_settings.DEFAULT_AUTHENTICATION_CLASSES
+        try:
+            user = Request(request, authenticators=[
+                authenticator() for authenticator in authenticators
+            ]).user
+        except APIException:
+            return False
+    return getattr(user, 'is_admin_or_staff', False)
+
+
+class RequestTimingMiddleware:
+    """
+    Инструментирование запросов: число и время SQL, повторяющиеся
+    запросы, время view и сериализации. Включается настройкой
+    REQUEST_TIMING_ENABLED с долей REQUEST_TIMING_SAMPLE_RATE или
+    заголовком X-Request-Timing от администратора или сотрудника,
+    права проверяются до инструментирования. Результат отдаётся
+    заголовком Server-Timing и строкой лога api.timing в JSON.
+    Выключенная проверка стоит одного чтения заголовка.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        sampled = (
+            settings.REQUEST_TIMING_ENABLED
+            and random.random() < settings.REQUEST_TIMING_SAMPLE_RATE
+        )
+        requested = (
+            not sampled
+            and TIMING_HEADER in request.META
+            and is_staff_request(request)
+        )
+        if not sampled and not requested:
+            return self.get_response(request)
+
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(timings):
+                response = self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        total_time = time.perf_counter() - started
+
+        # DRF переносит пользователя, найденного по токену, в исходный
+        # request, поэтому после view здесь уже виден автор запроса.
+        user = getattr(request, 'user', None)
+        view_time = total_time - timings.serializer_time
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={timings.db_time * 1000:.1f};'
+            f'desc="{timings.queries} queries"',
+            f'serializer;dur={timings.serializer_time * 1000:.1f}',
+            f'view;dur={view_time * 1000:.1f}',
+            f'total;dur={total_time * 1000:.1f}',
+        ])
+        resolver_match = getattr(request, 'resolver_match', None)
+        logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'route': resolver_match.url_name if resolver_match else None,
+            'status': response.status_code,
+            'user': getattr(user, 'pk', None),
+            'total_ms': round(total_time * 1000, 2),
+            'view_ms': round(view_time * 1000, 2),
+            'serializer_ms': round(timings.serializer_time * 1000, 2),
+            'db_ms': round(timings.db_time * 1000, 2),
+            'queries': timings.queries,
+            'repeated_queries': timings.repeated_statements(
+                settings.REQUEST_TIMING_REPEATED_QUERY_THRESHOLD
+            ),
+        }, ensure_ascii=False))
+        return response
+
+
+class QueryCounter:
+    """
+    Обёртка connection.execute_wrapper, которая только считает запросы
+    и их время.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.queries += 1
+
+
+def count_streamed_bytes(content, histogram):
+    """
+    Отдаёт части потокового ответа и после отправки последней, или
+    при обрыве соединения, записывает отправленный размер.
+    """
+
+    size = 0
+    try:
+        for chunk in content:
+            size += len(chunk)
+            yield chunk
+    finally:
+        histogram.observe(size)
+
+
+class MetricsMiddleware:
+    """
+    Пишет метрики Prometheus по каждому запросу. Маршрут берётся из
+    url_name, например recipes-list или recipes-favorite, поэтому id
+    из пути не раздувают число рядов. Размер потокового ответа
+    известен только после отправки, он записывается обёрткой
+    streaming_content.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        counter = QueryCounter()
+        started = time.perf_counter()
+        with connection.execute_wrapper(counter):
+            response = self.get_response(request)
+        duration = time.perf_counter() - started
+
+        resolver_match = getattr(request, 'resolver_match', None)
+        route = (
+            resolver_match.url_name or resolver_match.view_name
+            if resolver_match else 'unmatched'
+        )
+        REQUEST_COUNT.labels(
+            route, request.method, response.status_code
+        ).inc()
+        REQUEST_LATENCY.labels(route, request.method).observe(duration)
+        DB_QUERIES.labels(route).observe(counter.queries)
+        DB_DURATION.labels(route).observe(counter.duration)
+        if response.streaming:
+            response.streaming_content = count_streamed_bytes(
+                response.streaming_content, RESPONSE_SIZE.labels(route)
+            )
+        else:
+            RESPONSE_SIZE.labels(route).observe(len(response.content))
+        return response
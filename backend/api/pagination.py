@@ -1,4 +1,13 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+from collections import OrderedDict
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 
 class UserPageNumberPagination(PageNumberPagination):
@@ -9,3 +18,109 @@ class UserPageNumberPagination(PageNumberPagination):
 
     page_size_query_param = 'limit'
     page_size = 5
+
+
+class RecipeCursorPagination(BasePagination):
+    """
+    Keyset-пагинатор для ленты рецептов. Позиция задаётся парой
+    (pub_date, id) в порядке Recipe.Meta.ordering, поэтому глубокие
+    страницы читаются по индексу без OFFSET и без COUNT(*).
+    Курсоры next/previous непрозрачны для клиента. С поиском курсор
+    не сочетается: поиск сортирует по релевантности, а курсор задаёт
+    порядок ленты, поэтому такой запрос отклоняется с кодом 400.
+    """
+
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    page_size = UserPageNumberPagination.page_size
+    max_page_size = 100
+    invalid_cursor_message = 'Неверный курсор.'
+    search_not_supported_message = (
+        'Параметр cursor нельзя использовать вместе с search, '
+        'используйте page.'
+    )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if request.query_params.get(api_settings.SEARCH_PARAM, '').strip():
+            raise ValidationError(
+                {self.cursor_query_param: [self.search_not_supported_message]}
+            )
+        self.request = request
+        page_size = self.get_page_size(request)
+        position, reverse = self.decode_cursor(request)
+        if reverse:
+            queryset = queryset.order_by('pub_date', 'id')
+            if position is not None:
+                pub_date, pk = position
+                queryset = queryset.filter(pub_date__gte=pub_date).filter(
+                    Q(pub_date__gt=pub_date) | Q(id__gt=pk)
+                )
+        else:
+            queryset = queryset.order_by('-pub_date', '-id')
+            if position is not None:
+                pub_date, pk = position
+                queryset = queryset.filter(pub_date__lte=pub_date).filter(
+                    Q(pub_date__lt=pub_date) | Q(id__lt=pk)
+                )
+        results = list(queryset[:page_size + 1])
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if reverse:
+            results.reverse()
+            has_next, has_previous = position is not None, has_more
+        else:
+            has_next, has_previous = has_more, position is not None
+        self.next_cursor = None
+        self.previous_cursor = None
+        if results and has_next:
+            self.next_cursor = self.encode_cursor(results[-1], reverse=False)
+        if results and has_previous:
+            self.previous_cursor = self.encode_cursor(results[0], reverse=True)
+        return results
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def encode_cursor(self, recipe, reverse):
+        position = '|'.join(
+            (recipe.pub_date.isoformat(), str(recipe.pk), str(int(reverse)))
+        )
+        return base64.urlsafe_b64encode(position.encode()).decode()
+
+    def decode_cursor(self, request):
+        """
+        Пустой параметр cursor означает первую страницу.
+        """
+
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            position = base64.urlsafe_b64decode(encoded.encode()).decode()
+            pub_date, pk, reverse = position.split('|')
+            pub_date = parse_datetime(pub_date)
+            pk = int(pk)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if pub_date is None:
+            raise NotFound(self.invalid_cursor_message)
+        return (pub_date, pk), reverse == '1'
+
+    def get_link(self, cursor):
+        if cursor is None:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), 'page')
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_link(self.next_cursor)),
+            ('previous', self.get_link(self.previous_cursor)),
+            ('results', data),
+        ]))
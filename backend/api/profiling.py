@@ -0,0 +1,243 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import shutil
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection
+
+from .permissions import IsAdmin
+
+PROFILE_PARAM = 'profile'
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+
+
+class StackSampler(threading.Thread):
+    """
+    Сэмплирующий профилировщик: раз в interval секунд снимает стек
+    потока запроса и считает одинаковые стеки. Результат в формате
+    collapsed stacks для flamegraph.pl и speedscope.
+    """
+
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({code.co_filename})')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+    def collapsed(self):
+        return ''.join(
+            f'{stack} {count}\n'
+            for stack, count in self.stacks.most_common()
+        )
+
+
+class QueryRecorder:
+    """
+    Обёртка connection.execute_wrapper, которая запоминает SQL,
+    параметры и время каждого запроса.
+    """
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'sql': sql,
+                'params': None if many else params,
+                'many': many,
+                'duration_ms': (time.perf_counter() - started) * 1000,
+            })
+
+
+def explain(sql, params):
+    if connection.vendor == 'postgresql':
+        sql = f'EXPLAIN (ANALYZE, BUFFERS) {sql}'
+    elif connection.vendor == 'sqlite':
+        sql = f'EXPLAIN QUERY PLAN {sql}'
+    else:
+        sql = f'EXPLAIN {sql}'
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return '\n'.join(
+            ' '.join(str(column) for column in row)
+            for row in cursor.fetchall()
+        )
+
+
+class ProfileStore:
+    """
+    Кольцевой буфер профилей на диске: каждый профиль в своём каталоге,
+    после записи нового удаляются самые старые сверх max_profiles.
+    Имена каталогов начинаются со времени, поэтому сортировка по имени
+    совпадает с порядком записи и работает из любого воркера.
+    """
+
+    def __init__(self, directory, max_profiles):
+        self.directory = Path(directory)
+        self.max_profiles = max_profiles
+
+    def save(self, name, profiler, sampler, report):
+        profile_id = f'{time.time_ns()}-{os.getpid()}-{name}'
+        path = self.directory / profile_id
+        path.mkdir(parents=True)
+        profiler.dump_stats(path / 'profile.prof')
+        (path / 'stacks.folded').write_text(
+            sampler.collapsed(), encoding='utf-8'
+        )
+        (path / 'report.json').write_text(
+            json.dumps(report, ensure_ascii=False, indent=2, default=str),
+            encoding='utf-8',
+        )
+        self.prune()
+        return profile_id
+
+    def prune(self):
+        profiles = sorted(
+            entry.name for entry in os.scandir(self.directory)
+            if entry.is_dir()
+        )
+        for name in profiles[:-self.max_profiles]:
+            shutil.rmtree(self.directory / name, ignore_errors=True)
+
+
+profile_store = ProfileStore(
+    settings.PROFILING_DIR, settings.PROFILING_MAX_PROFILES
+)
+
+
+class ProfilingMixin:
+    """
+    Профилирование одного запроса по параметру ?profile=1 или заголовку
+    X-Profile для пользователей с правами IsAdmin. Запрос выполняется
+    под cProfile и сэмплирующим профилировщиком, SQL записывается,
+    для самых медленных SELECT выполняется EXPLAIN. Профиль сохраняется
+    в ProfileStore, его id возвращается в заголовке X-Profile-Id.
+    Остальные запросы платят только за проверку параметра и заголовка.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        """
+        Профилирование включается в initial, после аутентификации,
+        а выключается здесь в finally: при необработанном исключении
+        finalize_response не вызывается.
+        """
+
+        self._profiling = None
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            self.stop_profiling()
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if (
+            PROFILE_PARAM not in request.query_params
+            and PROFILE_HEADER not in request.META
+        ):
+            return
+        if not IsAdmin().has_permission(request, self):
+            return
+        self._profile_recorder = QueryRecorder()
+        self._profiling = ExitStack()
+        self._profiling.enter_context(
+            connection.execute_wrapper(self._profile_recorder)
+        )
+        self._profile_sampler = StackSampler(
+            threading.get_ident(), settings.PROFILING_SAMPLE_INTERVAL
+        )
+        self._profile_sampler.start()
+        self._profiling.callback(self._profile_sampler.stop)
+        self._profiler = cProfile.Profile()
+        self._profile_started = time.perf_counter()
+        self._profiler.enable()
+        self._profiling.callback(self._profiler.disable)
+
+    def stop_profiling(self):
+        """
+        Выключает cProfile, останавливает сэмплер и снимает обёртку
+        запросов. Повторный вызов ничего не делает.
+        """
+
+        profiling, self._profiling = self._profiling, None
+        if profiling is not None:
+            profiling.close()
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(
+            request, response, *args, **kwargs
+        )
+        if self._profiling is None:
+            return response
+        duration = time.perf_counter() - self._profile_started
+        self.stop_profiling()
+
+        stats = io.StringIO()
+        pstats.Stats(self._profiler, stream=stats).sort_stats(
+            'cumulative'
+        ).print_stats(settings.PROFILING_STATS_LIMIT)
+        queries = self._profile_recorder.queries
+        slowest = sorted(
+            (
+                query for query in queries
+                if not query['many']
+                and query['sql'].lstrip().upper().startswith('SELECT')
+            ),
+            key=lambda query: query['duration_ms'],
+            reverse=True,
+        )[:settings.PROFILING_EXPLAIN_LIMIT]
+        report = {
+            'method': request.method,
+            'path': request.get_full_path(),
+            'user': request.user.pk,
+            'status': response.status_code,
+            'duration_ms': duration * 1000,
+            'queries_count': len(queries),
+            'queries_ms': sum(query['duration_ms'] for query in queries),
+            'queries': queries,
+            'explain': [
+                {
+                    'sql': query['sql'],
+                    'params': query['params'],
+                    'duration_ms': query['duration_ms'],
+                    'plan': explain(query['sql'], query['params']),
+                }
+                for query in slowest
+            ],
+            'pstats': stats.getvalue(),
+        }
+        resolver_match = request.resolver_match
+        profile_id = profile_store.save(
+            resolver_match.url_name if resolver_match else 'unmatched',
+            self._profiler, self._profile_sampler, report,
+        )
+        response['X-Profile-Id'] = profile_id
+        return response
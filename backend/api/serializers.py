@@ -4,18 +4,22 @@ from django.contrib.auth import get_user_model
 from django.core.exceptions import BadRequest, ObjectDoesNotExist
 from django.core.files.base import ContentFile
 from django.db import transaction
-from django.db.models import F
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
+from api.middleware import TimedSerializerMixin
 from recipes.models import Ingredient, Recipe, RecipesIngredients, Tag
+from recipes.signals import recipe_changed
 
 User = get_user_model()
 MIN_INGREDIENT_AMOUNT = 1
 MAX_RECIPES_PER_PAGE = 6
+MAX_RECIPES_PER_BULK_REQUEST = 500
 
 
-class UserBasicSerializer(serializers.ModelSerializer):
+class UserBasicSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """
     Базовый сериализатор для модели User.
     """
@@ -37,10 +41,28 @@ class UserBasicSerializer(serializers.ModelSerializer):
         }
 
     def get_is_subscribed(self, obj):
-        user = self.context.get('request').user
-        if user.is_authenticated:
-            return user.subscriptions.filter(subscription=obj).exists()
-        return False
+        """
+        Если queryset аннотирован полем is_subscribed, используем его.
+        Иначе id авторов, на которых подписан текущий пользователь,
+        загружаются одним запросом и сохраняются в контексте, общем для
+        всех вложенных сериализаторов ответа, и дальше проверка сводится
+        к поиску во множестве.
+        """
+
+        is_subscribed = getattr(obj, 'is_subscribed', None)
+        if is_subscribed is not None:
+            return is_subscribed
+        request = self.context.get('request')
+        if request is None or not request.user.is_authenticated:
+            return False
+        user = request.user
+        if obj.pk == user.pk:
+            return False
+        if 'subscriptions' not in self.context:
+            self.context['subscriptions'] = set(
+                user.subscriptions.values_list('subscription_id', flat=True)
+            )
+        return obj.pk in self.context['subscriptions']
 
 
 class UserCreateSerializer(serializers.ModelSerializer):
@@ -126,7 +148,7 @@ class CustomTokenObtainPairSerializer(serializers.Serializer):
         return attrs
 
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """
     Сериализатор для модели Tag.
     """
@@ -151,7 +173,7 @@ class RecipesIngredientsSerializer(serializers.ModelSerializer):
         fields = ("id", "name", "measurement_unit", "amount")
 
 
-class RecipesSerializer(serializers.ModelSerializer):
+class RecipesSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """
     Сериализатор для модели Recipe. Сериализатор написан под нестандартный
     запрос JSON. В методах вручную вытаскиваются ingredients и tags, для
@@ -173,82 +195,235 @@ class RecipesSerializer(serializers.ModelSerializer):
 
     def get_ingredients(self, obj):
         """
-        Этот метод получает все ингредиенты которые относятся к рецептам с
-        посмощью связанной таблицы. Amount не относится к полям модели
-        Ingredient, а к связанной таблице. Поэтому мы реферсим amount через
-        recipe__amount.
+        Этот метод получает все ингредиенты рецепта из связанной таблицы
+        RecipesIngredients, где и хранится amount. Если строки уже
+        подгружены через prefetch_related во вьюсете, то дополнительных
+        запросов к базе данных не будет.
         """
 
-        recipe = obj
-        ingredients = recipe.ingredients.values(
-            'id',
-            'name',
-            'measurement_unit',
-            amount=F('recipe__amount'),)
-        return ingredients
+        if 'ingredient' in getattr(obj, '_prefetched_objects_cache', {}):
+            recipe_ingredients = obj.ingredient.all()
+        else:
+            recipe_ingredients = obj.ingredient.select_related('ingredient')
+        return [
+            {
+                'id': recipe_ingredient.ingredient.id,
+                'name': recipe_ingredient.ingredient.name,
+                'measurement_unit': (
+                    recipe_ingredient.ingredient.measurement_unit
+                ),
+                'amount': recipe_ingredient.amount,
+            }
+            for recipe_ingredient in recipe_ingredients
+        ]
 
     @staticmethod
     def recipes_ingredients_tags_create(tags, ingredients, recipe):
         """
         Этот метод используется для создания новых рецептов
-        внутри другого метода.
+        внутри другого метода. Теги и ингредиенты приходят уже
+        загруженными из базы данных при валидации.
         """
         with transaction.atomic():
             recipe.tags.set(tags)
             recipe_ingredients = [
                 RecipesIngredients(
-                    ingredient_id=i.get('id'),
-                    amount=i.get('amount'),
+                    ingredient=item['ingredient'],
+                    amount=item['amount'],
                     recipe=recipe
                 )
-                for i in ingredients
+                for item in ingredients
             ]
             RecipesIngredients.objects.bulk_create(recipe_ingredients)
+            recipe_changed.send(
+                sender=Recipe,
+                recipe=recipe,
+                created=True,
+                ingredient_changes={
+                    item['ingredient'].pk: (None, item['amount'])
+                    for item in ingredients
+                },
+                tags=tags,
+                tags_added={tag.pk for tag in tags},
+                tags_removed=set(),
+            )
         return recipe
 
+    @staticmethod
+    def update_tags(recipe, tags):
+        """
+        Добавляет и удаляет только те теги, которые изменились.
+        Возвращает множества id добавленных и удалённых тегов.
+        """
+
+        old_tag_ids = {tag.pk for tag in recipe.tags.all()}
+        new_tag_ids = {tag.pk for tag in tags}
+        tags_added = new_tag_ids - old_tag_ids
+        tags_removed = old_tag_ids - new_tag_ids
+        if tags_removed:
+            recipe.tags.remove(*tags_removed)
+        if tags_added:
+            recipe.tags.add(*tags_added)
+        return tags_added, tags_removed
+
+    @staticmethod
+    def update_ingredients(recipe, ingredients):
+        """
+        Сравнивает сохранённые ингредиенты рецепта с новыми: лишние строки
+        удаляются, новые создаются, у изменившихся обновляется amount.
+        Возвращает изменения в виде {ingredient_id: (old_amount,
+        new_amount)}.
+        """
+
+        old_rows = {
+            row.ingredient_id: row for row in recipe.ingredient.all()
+        }
+        new_amounts = {
+            item['ingredient'].pk: item['amount'] for item in ingredients
+        }
+        changes = {}
+        removed_rows = []
+        changed_rows = []
+        for ingredient_id, row in old_rows.items():
+            new_amount = new_amounts.get(ingredient_id)
+            if new_amount is None:
+                removed_rows.append(row.pk)
+            elif new_amount != row.amount:
+                changed_rows.append(row)
+            else:
+                continue
+            changes[ingredient_id] = (row.amount, new_amount)
+            row.amount = new_amount
+        added_rows = [
+            RecipesIngredients(
+                recipe=recipe, ingredient=item['ingredient'],
+                amount=item['amount'],
+            )
+            for item in ingredients
+            if item['ingredient'].pk not in old_rows
+        ]
+        for row in added_rows:
+            changes[row.ingredient_id] = (None, row.amount)
+        if removed_rows:
+            RecipesIngredients.objects.filter(pk__in=removed_rows).delete()
+        if changed_rows:
+            RecipesIngredients.objects.bulk_update(changed_rows, ['amount'])
+        if added_rows:
+            RecipesIngredients.objects.bulk_create(added_rows)
+        return changes
+
+    @staticmethod
+    def parse_int(value):
+        """
+        Целое число из JSON или строки формы. Дробные числа, например
+        2.7, не округляются, а считаются ошибкой, как и True и False.
+        Возвращает None, если значение не целое.
+        """
+
+        if isinstance(value, bool):
+            return None
+        if isinstance(value, int):
+            return value
+        if isinstance(value, float):
+            return int(value) if value.is_integer() else None
+        if isinstance(value, str):
+            try:
+                return int(value)
+            except ValueError:
+                return None
+        return None
+
+    @staticmethod
+    def format_ids(ids):
+        return ', '.join(str(pk) for pk in sorted(ids))
+
     def validate_tags(self):
+        """
+        Все теги проверяются одним запросом. Возвращает объекты Tag
+        в порядке, в котором они пришли в запросе.
+        """
+
         tags = self.initial_data.get('tags')
         if not tags:
             raise serializers.ValidationError(
                 'Необходимо добавить теги.')
-        unique_tags = set(tags)
-        if len(unique_tags) < len(tags):
+        if not isinstance(tags, list):
+            raise serializers.ValidationError(
+                'Теги нужно передать списком id.')
+        tag_ids = [self.parse_int(tag) for tag in tags]
+        if None in tag_ids:
+            raise serializers.ValidationError(
+                'Id тегов должны быть целыми числами.')
+        if len(set(tag_ids)) < len(tag_ids):
             raise serializers.ValidationError(
                 'В списке есть теги дубликаты.'
             )
-        for tag in tags:
-            try:
-                Tag.objects.get(id=tag)
-            except Tag.DoesNotExist:
-                raise serializers.ValidationError(
-                    f'Тэг с id {tag} не существует.'
-                )
-        return tags
+        existing_tags = Tag.objects.in_bulk(tag_ids)
+        missing_ids = set(tag_ids) - existing_tags.keys()
+        if missing_ids:
+            raise serializers.ValidationError(
+                f'Тэги с id {self.format_ids(missing_ids)} не существуют.'
+            )
+        return [existing_tags[tag_id] for tag_id in tag_ids]
 
     def validate_ingredients(self):
+        """
+        Все ингредиенты проверяются одним запросом. Возвращает список
+        словарей с объектом Ingredient и целым amount.
+        """
+
         ingredients = self.initial_data.get('ingredients')
         if not ingredients:
             raise serializers.ValidationError(
                 'Необходимо добавить ингредиенты.')
-        diblicate_ingredients = []
+        if not isinstance(ingredients, list) or not all(
+            isinstance(ingredient, dict) for ingredient in ingredients
+        ):
+            raise serializers.ValidationError(
+                'Ингредиенты нужно передать списком объектов '
+                'с полями id и amount.')
+        parsed_ingredients = []
         for ingredient in ingredients:
-            if ingredient['id'] in diblicate_ingredients:
+            ingredient_id = self.parse_int(ingredient.get('id'))
+            amount = self.parse_int(ingredient.get('amount'))
+            if ingredient_id is None:
                 raise serializers.ValidationError(
-                    f'У ингредиента с id {ingredient["id"]} есть дубликат.'
-                )
-            diblicate_ingredients.append(ingredient['id'])
-            if int(ingredient['amount']) < 1:
+                    'Id ингредиентов должны быть целыми числами.')
+            if amount is None:
+                raise serializers.ValidationError(
+                    f'Количество ингредиента с id {ingredient_id} '
+                    'должно быть целым числом.')
+            if amount < MIN_INGREDIENT_AMOUNT:
                 raise serializers.ValidationError(
                     'Количество условных единиц '
                     'ингредиенов не может быть меньше 1.'
                 )
-            try:
-                Ingredient.objects.get(id=ingredient['id'])
-            except Ingredient.DoesNotExist:
-                raise serializers.ValidationError(
-                    f'Ингредиент с id {ingredient["id"]} не существует.'
-                )
-        return ingredients
+            parsed_ingredients.append((ingredient_id, amount))
+        seen_ids = set()
+        duplicate_ids = set()
+        for ingredient_id, _ in parsed_ingredients:
+            if ingredient_id in seen_ids:
+                duplicate_ids.add(ingredient_id)
+            seen_ids.add(ingredient_id)
+        if duplicate_ids:
+            raise serializers.ValidationError(
+                f'У ингредиентов с id {self.format_ids(duplicate_ids)} '
+                'есть дубликаты.'
+            )
+        existing_ingredients = Ingredient.objects.in_bulk(seen_ids)
+        missing_ids = seen_ids - existing_ingredients.keys()
+        if missing_ids:
+            raise serializers.ValidationError(
+                f'Ингредиенты с id {self.format_ids(missing_ids)} '
+                'не существуют.'
+            )
+        return [
+            {
+                'ingredient': existing_ingredients[ingredient_id],
+                'amount': amount,
+            }
+            for ingredient_id, amount in parsed_ingredients
+        ]
 
     def validate(self, data):
         data.update({'author': self.context.get('request').user,
@@ -256,6 +431,7 @@ class RecipesSerializer(serializers.ModelSerializer):
                      'tags': self.validate_tags()})
         return data
 
+    @transaction.atomic
     def create(self, validated_data):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
@@ -264,21 +440,26 @@ class RecipesSerializer(serializers.ModelSerializer):
             tags, ingredients, recipe
         )
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
         instance = super().update(instance, validated_data)
-        instance.tags.clear()
-        instance.tags.set(tags)
-        instance.ingredients.clear()
-        self.recipes_ingredients_tags_create(
-            tags, ingredients, instance
+        tags_added, tags_removed = self.update_tags(instance, tags)
+        ingredient_changes = self.update_ingredients(instance, ingredients)
+        recipe_changed.send(
+            sender=Recipe,
+            recipe=instance,
+            created=False,
+            ingredient_changes=ingredient_changes,
+            tags=tags,
+            tags_added=tags_added,
+            tags_removed=tags_removed,
         )
-        instance.save()
         return instance
 
 
-class RecipeBriefSerializer(serializers.ModelSerializer):
+class RecipeBriefSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """
     Сериализатор для краткого представления рецептов.
     """
@@ -288,7 +469,36 @@ class RecipeBriefSerializer(serializers.ModelSerializer):
         fields = ["id", "name", "image", "cooking_time"]
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class RecipeIdsSerializer(serializers.Serializer):
+    """
+    Сериализатор тела запроса пакетных эндпоинтов shopping_cart и
+    favorite: список id рецептов или all для удаления всех рецептов.
+    """
+
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=MAX_RECIPES_PER_BULK_REQUEST,
+        required=False,
+    )
+    all = serializers.BooleanField(default=False)
+
+    def validate(self, data):
+        if data['all'] and 'recipes' in data:
+            raise serializers.ValidationError(
+                'Передайте либо recipes, либо all.')
+        if data['all'] and not self.context.get('allow_all'):
+            raise serializers.ValidationError(
+                'Параметр all доступен только для удаления.')
+        if not data['all'] and 'recipes' not in data:
+            raise serializers.ValidationError(
+                'Необходимо передать список id рецептов.')
+        if 'recipes' in data:
+            data['recipes'] = list(dict.fromkeys(data['recipes']))
+        return data
+
+
+class IngredientSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """
     Сериализатор для ингредиентов.
     """
@@ -304,21 +514,58 @@ class UserSubscriptionsSerializer(UserBasicSerializer):
     """
 
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
+    recipes_count = serializers.IntegerField(read_only=True)
 
-    def get_recipes(self, obj):
+    def get_recipes_limit(self):
         request = self.context.get('request')
         recipes_limit = request.GET.get('recipes_limit')
-        recipes = obj.recipes.all()
         if recipes_limit is not None and recipes_limit.isdigit():
-            recipes_limit = int(recipes_limit)
+            return int(recipes_limit)
+        return MAX_RECIPES_PER_PAGE
+
+    def get_recipes_by_author(self):
+        """
+        Последние recipes_limit рецептов каждого автора страницы выбираются
+        одним запросом через ROW_NUMBER() OVER (PARTITION BY author_id
+        ORDER BY pub_date DESC, id DESC), в порядке ленты. Результат
+        сохраняется в контексте, общем для всех сериализаторов ответа.
+        """
+
+        if 'recipes_by_author' in self.context:
+            return self.context['recipes_by_author']
+        if isinstance(self.parent, serializers.ListSerializer):
+            authors = self.parent.instance
         else:
-            recipes_limit = MAX_RECIPES_PER_PAGE
-        recipes = recipes[:recipes_limit]
-        return RecipeBriefSerializer(recipes, many=True).data
+            authors = [self.instance]
+        if not authors:
+            return {}
+        ranked_recipes = Recipe.objects.filter(
+            author__in=[author.pk for author in authors]
+        ).annotate(
+            recipe_rank=Window(
+                expression=RowNumber(),
+                partition_by=[F('author_id')],
+                order_by=[F('pub_date').desc(), F('id').desc()],
+            )
+        ).order_by().values(
+            'id', 'author_id', 'name', 'image', 'cooking_time', 'recipe_rank'
+        )
+        sql, params = ranked_recipes.query.sql_with_params()
+        recipes = Recipe.objects.raw(
+            f'SELECT * FROM ({sql}) ranked_recipes '
+            'WHERE ranked_recipes.recipe_rank <= %s '
+            'ORDER BY ranked_recipes.recipe_rank',
+            (*params, self.get_recipes_limit()),
+        )
+        recipes_by_author = {author.pk: [] for author in authors}
+        for recipe in recipes:
+            recipes_by_author[recipe.author_id].append(recipe)
+        self.context['recipes_by_author'] = recipes_by_author
+        return recipes_by_author
 
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
+    def get_recipes(self, obj):
+        recipes = self.get_recipes_by_author().get(obj.pk, [])
+        return RecipeBriefSerializer(recipes, many=True).data
 
     class Meta:
         model = User
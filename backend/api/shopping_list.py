@@ -0,0 +1,481 @@
+import csv
+import io
+import json
+import zlib
+from collections import namedtuple
+from datetime import datetime
+from functools import lru_cache
+from itertools import chain
+
+from django.conf import settings
+from django.db.models import F
+from fontTools import subset
+from fontTools.ttLib import TTFont
+from fontTools.ttLib.tables._c_m_a_p import CmapSubtable
+from rest_framework.exceptions import NotAcceptable
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import JSONRenderer
+
+from recipes.models import ShoppingListIngredient
+
+ITERATOR_CHUNK_SIZE = 2000
+FOOTER = 'Сформировано на сайте www.iceadmin.ru, проект Foodgram'
+PDF_FONT_FILE = settings.BASE_DIR / 'fonts' / 'DejaVuSans.ttf'
+
+PdfFont = namedtuple(
+    'PdfFont',
+    'name data length to_unicode widths bbox ascent descent cap_height',
+)
+
+
+class ShoppingListTxtRenderer(JSONRenderer):
+    """
+    Рендереры списка покупок нужны для согласования формата через
+    ?format= или заголовок Accept. Сам список отдаётся потоком, а через
+    рендерер проходят только ответы с ошибками.
+    """
+
+    media_type = 'text/plain'
+    format = 'txt'
+    charset = 'utf-8'
+
+
+class ShoppingListCsvRenderer(ShoppingListTxtRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class ShoppingListJsonRenderer(ShoppingListTxtRenderer):
+    media_type = 'application/json'
+    format = 'json'
+
+
+class ShoppingListPdfRenderer(ShoppingListTxtRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+
+
+SHOPPING_LIST_RENDERERS = (
+    ShoppingListTxtRenderer,
+    ShoppingListCsvRenderer,
+    ShoppingListJsonRenderer,
+    ShoppingListPdfRenderer,
+)
+
+
+class ShoppingListContentNegotiation(DefaultContentNegotiation):
+    """
+    Неизвестный ?format= это 406 со списком форматов, а не 404,
+    который DRF отдаёт по умолчанию.
+    """
+
+    def filter_renderers(self, renderers, format):
+        filtered = [
+            renderer for renderer in renderers if renderer.format == format
+        ]
+        if not filtered:
+            raise NotAcceptable(
+                f'Формат {format} не поддерживается. Доступные форматы: '
+                + ', '.join(renderer.format for renderer in renderers)
+                + '.'
+            )
+        return filtered
+
+
+def get_shopping_list(user):
+    """
+    Список покупок пользователя из агрегата ShoppingListIngredient,
+    который поддерживается при изменении корзины, в алфавитном порядке.
+    Строки читаются серверным курсором, а не загружаются в память целиком.
+    """
+
+    return (
+        ShoppingListIngredient.objects
+        .filter(user=user)
+        .values(
+            'total_amount',
+            ingredient_name=F('ingredient__name'),
+            measurement_unit=F('ingredient__measurement_unit'),
+        )
+        .order_by('ingredient_name', 'measurement_unit')
+        .iterator(chunk_size=ITERATOR_CHUNK_SIZE)
+    )
+
+
+def get_title(user):
+    current_date = datetime.now().strftime("%Y-%m-%d")
+    return f"{user.username}, Ваш список покупок на {current_date}"
+
+
+def render_txt(user):
+    yield f"{get_title(user)}\n\n\n"
+    for ingredient in get_shopping_list(user):
+        yield (
+            f"{ingredient['ingredient_name']}"
+            f"({ingredient['measurement_unit']}) — "
+            f"{ingredient['total_amount']}\n"
+        )
+    yield f"\n\n\n{FOOTER}"
+
+
+class Echo:
+    """
+    Объект с методом write, который просто возвращает строку, чтобы
+    csv.writer отдавал строки генератору, а не копил их в буфере.
+    """
+
+    def write(self, value):
+        return value
+
+
+def render_csv(user):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('ingredient', 'measurement_unit', 'amount'))
+    for ingredient in get_shopping_list(user):
+        yield writer.writerow((
+            ingredient['ingredient_name'],
+            ingredient['measurement_unit'],
+            ingredient['total_amount'],
+        ))
+
+
+def render_json(user):
+    yield (
+        '{"user": %s, "date": %s, "ingredients": [' % (
+            json.dumps(user.username, ensure_ascii=False),
+            json.dumps(datetime.now().strftime("%Y-%m-%d")),
+        )
+    )
+    separator = ''
+    for ingredient in get_shopping_list(user):
+        yield separator + json.dumps({
+            'name': ingredient['ingredient_name'],
+            'measurement_unit': ingredient['measurement_unit'],
+            'amount': ingredient['total_amount'],
+        }, ensure_ascii=False)
+        separator = ', '
+    yield ']}'
+
+
+@lru_cache(maxsize=None)
+def load_pdf_font():
+    """
+    Подмножество PDF_FONT_FILE с символами cp1251, сжатое для потока
+    FontFile2, и метрики для PDF в единицах 1/1000 кегля. Таблица cmap
+    подмножества заменяется символьной, в которой глифы адресуются
+    прямо кодами cp1251: программе просмотра не нужно искать глиф по
+    имени или через Unicode. Для копирования текста строится CMap
+    ToUnicode. Ширины лежат по кодам cp1251, для кодов без символа
+    ширина 0. Строится один раз на процесс.
+    """
+
+    font = TTFont(PDF_FONT_FILE)
+    characters = {
+        code: bytes([code]).decode('cp1251', errors='ignore')
+        for code in range(PdfWriter.FIRST_CHAR, 256)
+    }
+    options = subset.Options()
+    # Таблица меток времени FontForge, подмножеству она не нужна.
+    options.drop_tables.append('FFTM')
+    subsetter = subset.Subsetter(options)
+    subsetter.populate(text=''.join(characters.values()))
+    subsetter.subset(font)
+    unicode_glyphs = font.getBestCmap()
+    glyphs = {
+        code: unicode_glyphs[ord(char)]
+        for code, char in characters.items()
+        if char and ord(char) in unicode_glyphs
+    }
+    windows = CmapSubtable.newSubtable(4)
+    windows.platformID, windows.platEncID, windows.language = 3, 0, 0
+    windows.cmap = {0xF000 + code: glyph for code, glyph in glyphs.items()}
+    macintosh = CmapSubtable.newSubtable(0)
+    macintosh.platformID, macintosh.platEncID, macintosh.language = 1, 0, 0
+    macintosh.cmap = dict(glyphs)
+    font['cmap'].tables = [windows, macintosh]
+    buffer = io.BytesIO()
+    font.save(buffer)
+    data = buffer.getvalue()
+    scale = 1000 / font['head'].unitsPerEm
+    widths = [0] * 256
+    for code, glyph in glyphs.items():
+        widths[code] = round(font['hmtx'][glyph][0] * scale)
+    to_unicode = (
+        b'/CIDInit /ProcSet findresource begin 12 dict begin begincmap\n'
+        b'/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) '
+        b'/Supplement 0 >> def\n'
+        b'/CMapName /Adobe-Identity-UCS def /CMapType 2 def\n'
+        b'1 begincodespacerange <00> <FF> endcodespacerange\n'
+        b'%d beginbfchar\n%s\nendbfchar\n'
+        b'endcmap CMapName currentdict /CMap defineresource pop end end'
+    ) % (
+        len(glyphs),
+        b'\n'.join(
+            b'<%02X> <%04X>' % (code, ord(characters[code]))
+            for code in glyphs
+        ),
+    )
+    head = font['head']
+    return PdfFont(
+        name=font['name'].getDebugName(6),
+        data=zlib.compress(data),
+        length=len(data),
+        to_unicode=zlib.compress(to_unicode),
+        widths=widths,
+        bbox=[
+            round(value * scale)
+            for value in (head.xMin, head.yMin, head.xMax, head.yMax)
+        ],
+        ascent=round(font['hhea'].ascent * scale),
+        descent=round(font['hhea'].descent * scale),
+        cap_height=round(
+            font['glyf'][unicode_glyphs[ord('H')]].yMax * scale
+        ),
+    )
+
+
+class PdfWriter:
+    """
+    Минимальный генератор PDF 1.4, который отдаёт документ по частям:
+    каждая страница записывается сразу после заполнения, а каталог,
+    дерево страниц, шрифт и таблица xref в конце. Текст в кодировке
+    cp1251, подмножество шрифта из load_pdf_font встраивается
+    в документ, поэтому кириллица видна в любой программе просмотра.
+    Строки шире страницы переносятся по пробелам, слово длиннее строки
+    по буквам.
+    """
+
+    CATALOG_ID = 1
+    PAGES_ID = 2
+    FONT_ID = 3
+    FONT_DESCRIPTOR_ID = 4
+    FONT_FILE_ID = 5
+    TO_UNICODE_ID = 6
+    PAGE_WIDTH = 595
+    PAGE_HEIGHT = 842
+    MARGIN = 50
+    FONT_SIZE = 12
+    LEADING = 16
+    LINES_PER_PAGE = (PAGE_HEIGHT - 2 * MARGIN) // LEADING
+    FIRST_CHAR = 32
+    # Подмножество шрифта одно и то же для всех документов, поэтому
+    # и тег подмножества в имени шрифта постоянный.
+    SUBSET_TAG = b'CPCYRL'
+
+    def __init__(self):
+        self.position = 0
+        self.offsets = {}
+        self.page_ids = []
+        self.lines = []
+        self.next_id = self.TO_UNICODE_ID + 1
+        self.font_metrics = load_pdf_font()
+
+    def write_object(self, object_id, body):
+        data = b'%d 0 obj\n%s\nendobj\n' % (object_id, body)
+        self.offsets[object_id] = self.position
+        self.position += len(data)
+        return data
+
+    def allocate_id(self):
+        object_id = self.next_id
+        self.next_id += 1
+        return object_id
+
+    def header(self):
+        data = b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n'
+        self.position += len(data)
+        return data
+
+    @staticmethod
+    def escape(data):
+        return (
+            data.replace(b'\\', b'\\\\')
+            .replace(b'(', b'\\(')
+            .replace(b')', b'\\)')
+        )
+
+    def wrap(self, text):
+        """
+        Разбивает строку в cp1251 на части не шире области текста.
+        """
+
+        data = text.encode('cp1251', errors='replace')
+        widths = self.font_metrics.widths
+        max_width = (
+            (self.PAGE_WIDTH - 2 * self.MARGIN) * 1000 // self.FONT_SIZE
+        )
+        parts = []
+        start = width = 0
+        space = None
+        for index, code in enumerate(data):
+            width += widths[code]
+            if width > max_width and index > start:
+                end = space + 1 if space is not None else index
+                parts.append(data[start:end])
+                start = end
+                width = sum(widths[code] for code in data[start:index + 1])
+                space = None
+            if code == 0x20:
+                space = index
+        parts.append(data[start:])
+        return parts
+
+    def add_line(self, text):
+        """
+        Добавляет строку и возвращает страницы, которые ею заполнились.
+        """
+
+        data = b''
+        for part in self.wrap(text):
+            self.lines.append(part)
+            if len(self.lines) == self.LINES_PER_PAGE:
+                data += self.page(self.lines)
+                self.lines = []
+        return data
+
+    def page(self, lines):
+        content = b'BT /F1 %d Tf %d TL %d %d Td\n' % (
+            self.FONT_SIZE,
+            self.LEADING,
+            self.MARGIN,
+            self.PAGE_HEIGHT - self.MARGIN - self.FONT_SIZE,
+        )
+        content += b''.join(
+            b'(%s) Tj T*\n' % self.escape(line) for line in lines
+        )
+        content += b'ET'
+        content_id = self.allocate_id()
+        page_id = self.allocate_id()
+        self.page_ids.append(page_id)
+        data = self.write_object(
+            content_id,
+            b'<< /Length %d >>\nstream\n%s\nendstream' % (
+                len(content), content
+            ),
+        )
+        data += self.write_object(
+            page_id,
+            b'<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %d %d] '
+            b'/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>' % (
+                self.PAGES_ID,
+                self.PAGE_WIDTH,
+                self.PAGE_HEIGHT,
+                self.FONT_ID,
+                content_id,
+            ),
+        )
+        return data
+
+    def font(self):
+        """
+        Простой символьный шрифт TrueType без /Encoding: коды строк
+        адресуют глифы через cmap встроенного подмножества.
+        """
+
+        metrics = self.font_metrics
+        font_name = self.SUBSET_TAG + b'+' + metrics.name.encode()
+        data = self.write_object(
+            self.FONT_FILE_ID,
+            b'<< /Length %d /Length1 %d /Filter /FlateDecode >>\n'
+            b'stream\n%s\nendstream' % (
+                len(metrics.data), metrics.length, metrics.data
+            ),
+        )
+        data += self.write_object(
+            self.FONT_DESCRIPTOR_ID,
+            b'<< /Type /FontDescriptor /FontName /%s /Flags 4 '
+            b'/FontBBox [%d %d %d %d] /ItalicAngle 0 /Ascent %d '
+            b'/Descent %d /CapHeight %d /StemV 80 /FontFile2 %d 0 R >>' % (
+                font_name,
+                *metrics.bbox,
+                metrics.ascent,
+                metrics.descent,
+                metrics.cap_height,
+                self.FONT_FILE_ID,
+            ),
+        )
+        data += self.write_object(
+            self.TO_UNICODE_ID,
+            b'<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream' % (
+                len(metrics.to_unicode), metrics.to_unicode
+            ),
+        )
+        data += self.write_object(
+            self.FONT_ID,
+            b'<< /Type /Font /Subtype /TrueType /BaseFont /%s '
+            b'/FirstChar %d /LastChar 255 /Widths [%s] '
+            b'/FontDescriptor %d 0 R /ToUnicode %d 0 R >>' % (
+                font_name,
+                self.FIRST_CHAR,
+                b' '.join(
+                    b'%d' % width
+                    for width in metrics.widths[self.FIRST_CHAR:]
+                ),
+                self.FONT_DESCRIPTOR_ID,
+                self.TO_UNICODE_ID,
+            ),
+        )
+        return data
+
+    def trailer(self):
+        if self.lines or not self.page_ids:
+            data = self.page(self.lines)
+            self.lines = []
+        else:
+            data = b''
+        kids = b' '.join(b'%d 0 R' % page_id for page_id in self.page_ids)
+        data += self.font()
+        data += self.write_object(
+            self.PAGES_ID,
+            b'<< /Type /Pages /Kids [%s] /Count %d >>' % (
+                kids, len(self.page_ids)
+            ),
+        )
+        data += self.write_object(
+            self.CATALOG_ID,
+            b'<< /Type /Catalog /Pages %d 0 R >>' % self.PAGES_ID,
+        )
+        xref_position = self.position
+        data += b'xref\n0 %d\n0000000000 65535 f \n' % self.next_id
+        data += b''.join(
+            b'%010d 00000 n \n' % self.offsets[object_id]
+            for object_id in range(1, self.next_id)
+        )
+        data += b'trailer\n<< /Size %d /Root %d 0 R >>\n' % (
+            self.next_id, self.CATALOG_ID
+        )
+        data += b'startxref\n%d\n%%%%EOF\n' % xref_position
+        return data
+
+
+def render_pdf(user):
+    writer = PdfWriter()
+    yield writer.header()
+    lines = chain(
+        (get_title(user), ''),
+        (
+            f"{ingredient['ingredient_name']}"
+            f"({ingredient['measurement_unit']}) — "
+            f"{ingredient['total_amount']}"
+            for ingredient in get_shopping_list(user)
+        ),
+        ('', FOOTER),
+    )
+    for line in lines:
+        data = writer.add_line(line)
+        if data:
+            yield data
+    yield writer.trailer()
+
+
+SHOPPING_LIST_FORMATS = {
+    'txt': render_txt,
+    'csv': render_csv,
+    'json': render_json,
+    'pdf': render_pdf,
+}
+
+
+def render_shopping_list(user, file_format):
+    return SHOPPING_LIST_FORMATS[file_format](user)
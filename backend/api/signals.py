@@ -0,0 +1,114 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+
+from recipes.models import Ingredient, Recipe, Tag
+from recipes.signals import recipe_changed
+
+from .cache import (CATALOG, FEED, author_scope, recipe_scope,
+                    response_cache_versions, tag_scope)
+
+User = get_user_model()
+
+# Поля пользователя, которые выводятся в рецептах.
+AUTHOR_FIELDS = ('email', 'username', 'first_name', 'last_name')
+
+
+def get_tag_slugs(recipe):
+    """
+    Слаги текущих тегов рецепта. Во вьюсете теги уже загружены через
+    prefetch_related, тогда запроса к базе данных нет.
+    """
+
+    prefetched = getattr(recipe, '_prefetched_objects_cache', {})
+    if 'tags' in prefetched:
+        return {tag.slug for tag in prefetched['tags']}
+    return set(
+        Tag.objects.filter(recipes=recipe.pk).values_list('slug', flat=True)
+    )
+
+
+def bump_recipe(recipe, slugs):
+    """
+    Меняет версии ленты, рецепта, его автора и тегов со слагами slugs.
+    """
+
+    response_cache_versions.bump([
+        FEED,
+        author_scope(recipe.author_id),
+        recipe_scope(recipe.pk),
+        *(tag_scope(slug) for slug in slugs),
+    ])
+
+
+@receiver(post_save, sender=Recipe)
+def bump_saved_recipe(sender, instance, created, **kwargs):
+    """
+    У нового рецепта ещё нет тегов. Теги и ингредиенты меняются после
+    сохранения, об этом сообщает сигнал recipe_changed.
+    """
+
+    bump_recipe(instance, () if created else get_tag_slugs(instance))
+
+
+@receiver(pre_delete, sender=Recipe)
+def bump_deleted_recipe(sender, instance, **kwargs):
+    bump_recipe(instance, get_tag_slugs(instance))
+
+
+@receiver(recipe_changed)
+def bump_changed_recipe(sender, recipe, tags, **kwargs):
+    """
+    Изменение ингредиентов. Привязка и отвязка тегов меняют версии
+    в bump_recipe_tags.
+    """
+
+    bump_recipe(recipe, {tag.slug for tag in tags})
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def bump_recipe_tags(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Любое изменение тегов рецептов через ORM, с любой стороны связи.
+    Отвязанные теги тоже меняют версию: рецепт пропал из их выборки.
+    При очистке связи берутся до удаления, после него их уже нет.
+    """
+
+    if action == 'pre_clear':
+        related = instance.recipes if reverse else instance.tags
+        pk_set = set(related.values_list('pk', flat=True))
+    elif action not in ('post_add', 'post_remove'):
+        return
+    if not pk_set:
+        return
+    if not reverse:
+        bump_recipe(instance, Tag.objects.filter(
+            pk__in=pk_set
+        ).values_list('slug', flat=True))
+        return
+    scopes = [FEED, tag_scope(instance.slug)]
+    for recipe_id, author_id in Recipe.objects.filter(
+        pk__in=pk_set
+    ).values_list('pk', 'author_id'):
+        scopes += [recipe_scope(recipe_id), author_scope(author_id)]
+    response_cache_versions.bump(scopes)
+
+
+@receiver([post_save, post_delete], sender=Tag)
+@receiver([post_save, post_delete], sender=Ingredient)
+def bump_catalog(sender, **kwargs):
+    response_cache_versions.bump([CATALOG])
+
+
+@receiver(post_save, sender=User)
+def bump_catalog_on_author_change(sender, instance, created, **kwargs):
+    """
+    Пользователь виден в ответах только как автор рецептов. Рецепты
+    удалённого автора удаляются каскадом и меняют версии сами.
+    """
+
+    if created or not instance.changed_fields(AUTHOR_FIELDS):
+        return
+    if Recipe.objects.filter(author=instance.pk).exists():
+        response_cache_versions.bump([CATALOG])
@@ -0,0 +1,470 @@
+import re
+import threading
+
+from django.db import connection
+from django.test import (TestCase, TransactionTestCase, override_settings,
+                         skipUnlessDBFeature)
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from recipes.management.commands.check_query_plans import \
+    Command as CheckQueryPlans
+from recipes.models import Ingredient, Recipe, RecipesIngredients, Tag
+from recipes.services import recount_counters
+from users.models import User
+
+from .shopping_list import PdfWriter, load_pdf_font
+
+FAVORITES_TABLE = Recipe.favorites.through._meta.db_table
+CART_TABLE = Recipe.groceries_list.through._meta.db_table
+TRANSACTION_STATEMENTS = ('BEGIN', 'SAVEPOINT', 'RELEASE')
+
+
+def create_user(username):
+    return User.objects.create(
+        username=username,
+        email=f'{username}@example.com',
+        first_name=username,
+        last_name=username,
+        password='!',
+    )
+
+
+def create_recipes(author, count, tags=(), ingredients=()):
+    recipes = [
+        Recipe.objects.create(
+            author=author,
+            name=f'Рецепт {index}',
+            image='recipes/images/test.png',
+            text='Описание',
+            cooking_time=10,
+        )
+        for index in range(count)
+    ]
+    for recipe in recipes:
+        recipe.tags.set(tags)
+    RecipesIngredients.objects.bulk_create([
+        RecipesIngredients(recipe=recipe, ingredient=ingredient, amount=10)
+        for recipe in recipes
+        for ingredient in ingredients
+    ])
+    return recipes
+
+
+def make_client(user=None):
+    client = APIClient()
+    if user is not None:
+        client.force_authenticate(user)
+    return client
+
+
+@override_settings(RESPONSE_CACHE_ENABLED=False)
+class RecipeFlagsTest(TestCase):
+    """
+    Флаги is_favorited и is_in_shopping_cart считаются подзапросами
+    EXISTS и не размножают рецепт по строкам избранного.
+    """
+
+    favorites = 10000
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.user = create_user('user')
+        cls.popular, *cls.others = create_recipes(cls.author, 3)
+        User.objects.bulk_create([
+            User(
+                username=f'fan{index}',
+                email=f'fan{index}@example.com',
+                password='!',
+            )
+            for index in range(cls.favorites - 1)
+        ])
+        Recipe.favorites.through.objects.bulk_create([
+            Recipe.favorites.through(recipe=cls.popular, user_id=user_id)
+            for user_id in User.objects.exclude(
+                pk=cls.author.pk
+            ).values_list('pk', flat=True)
+        ])
+        Recipe.groceries_list.through.objects.create(
+            recipe=cls.others[0], user=cls.user
+        )
+
+    def test_recipe_list_has_one_row_per_recipe(self):
+        for label, client in (
+            ('anonymous', make_client()),
+            ('authenticated', make_client(self.user)),
+        ):
+            with self.subTest(client=label):
+                response = client.get('/api/recipes/', {'limit': 10})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.data['count'], 3)
+                ids = [recipe['id'] for recipe in response.data['results']]
+                self.assertCountEqual(
+                    ids, [self.popular.pk, *(r.pk for r in self.others)]
+                )
+
+    def test_flags_of_current_user(self):
+        response = make_client(self.user).get('/api/recipes/')
+        flags = {
+            recipe['id']: (
+                recipe['is_favorited'], recipe['is_in_shopping_cart']
+            )
+            for recipe in response.data['results']
+        }
+        self.assertEqual(flags, {
+            self.popular.pk: (True, False),
+            self.others[0].pk: (False, True),
+            self.others[1].pk: (False, False),
+        })
+
+    def test_flag_filters(self):
+        client = make_client(self.user)
+        for params, expected in (
+            ({'is_favorited': 1}, [self.popular.pk]),
+            ({'is_in_shopping_cart': 1}, [self.others[0].pk]),
+        ):
+            with self.subTest(params=params):
+                response = client.get('/api/recipes/', params)
+                self.assertEqual(response.data['count'], 1)
+                self.assertEqual(
+                    [recipe['id'] for recipe in response.data['results']],
+                    expected,
+                )
+
+    def test_anonymous_list_skips_flag_subqueries(self):
+        with CaptureQueriesContext(connection) as queries:
+            make_client().get('/api/recipes/')
+        for query in queries.captured_queries:
+            self.assertNotIn(FAVORITES_TABLE, query['sql'])
+            self.assertNotIn(CART_TABLE, query['sql'])
+
+    def test_query_plan_uses_semi_joins(self):
+        """
+        Таблица избранного читается только через EXISTS по индексу,
+        без JOIN и без последовательного сканирования.
+        """
+
+        check_query_plans = CheckQueryPlans()
+        for params in ({}, {'is_favorited': 1}):
+            with self.subTest(params=params):
+                with CaptureQueriesContext(connection) as queries:
+                    make_client(self.user).get('/api/recipes/', params)
+                selects = [
+                    query['sql'] for query in queries.captured_queries
+                    if FAVORITES_TABLE in query['sql']
+                ]
+                self.assertTrue(selects)
+                for sql in selects:
+                    self.assertIn('EXISTS', sql)
+                    self.assertNotIn(f'JOIN "{FAVORITES_TABLE}"', sql)
+                    self.assertNotIn(
+                        FAVORITES_TABLE, check_query_plans.find_seq_scans(sql)
+                    )
+
+
+@override_settings(RESPONSE_CACHE_ENABLED=False)
+class RecipeListQueriesTest(TestCase):
+    """
+    Число запросов страницы рецептов не зависит от её размера.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.user = create_user('user')
+        tags = [
+            Tag.objects.create(
+                name=f'Тег {index}', color=f'#00000{index}', slug=f'tag{index}'
+            )
+            for index in range(2)
+        ]
+        ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {index}', measurement_unit='г'
+            )
+            for index in range(3)
+        ]
+        create_recipes(cls.author, 200, tags, ingredients)
+
+    def assert_page_queries(self, client, num):
+        for limit in (6, 50, 200):
+            with self.subTest(limit=limit):
+                with self.assertNumQueries(num):
+                    response = client.get('/api/recipes/', {'limit': limit})
+                self.assertEqual(len(response.data['results']), limit)
+                for recipe in response.data['results']:
+                    self.assertEqual(len(recipe['ingredients']), 3)
+                    self.assertEqual(len(recipe['tags']), 2)
+
+    def test_anonymous_list(self):
+        self.assert_page_queries(make_client(), 4)
+
+    def test_authenticated_list(self):
+        self.assert_page_queries(make_client(self.user), 5)
+
+    def test_cursor_with_search_is_rejected(self):
+        """
+        Курсор задаёт порядок ленты и отбросил бы ранжирование поиска.
+        """
+
+        response = make_client().get(
+            '/api/recipes/', {'cursor': '', 'search': 'Рецепт'}
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('cursor', response.data)
+
+
+@override_settings(
+    RESPONSE_CACHE_ENABLED=True,
+    CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }},
+)
+class ResponseCacheTagsTest(TestCase):
+    """
+    Изменение тегов рецепта через ORM с любой стороны связи сбрасывает
+    кеш ответов для анонимов.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.tag = Tag.objects.create(
+            name='Тег', color='#000000', slug='tag'
+        )
+        cls.recipes = create_recipes(cls.author, 2, [cls.tag])
+
+    def assert_count(self, count):
+        response = make_client().get('/api/recipes/', {'tags': 'tag'})
+        self.assertEqual(response.data['count'], count)
+
+    def test_tag_changes_reset_cache(self):
+        recipe = self.recipes[0]
+        self.assert_count(2)
+        for label, change, count in (
+            ('remove', lambda: recipe.tags.remove(self.tag), 1),
+            ('add', lambda: recipe.tags.add(self.tag), 2),
+            ('reverse remove', lambda: self.tag.recipes.remove(recipe), 1),
+            ('reverse clear', lambda: self.tag.recipes.clear(), 0),
+        ):
+            with self.subTest(change=label):
+                with self.captureOnCommitCallbacks(execute=True):
+                    change()
+                self.assert_count(count)
+
+
+class RelationCountersTest(TestCase):
+    """
+    Изменение избранного и корзины через ORM, например в админке,
+    оставляет счётчики равными числу связей, в том числе при удалении
+    отсутствующих связей и очистке.
+    """
+
+    def test_orm_changes_keep_counters(self):
+        author, user, other = (
+            create_user(name) for name in ('author', 'user', 'other')
+        )
+        recipe, second = create_recipes(author, 2)
+        for relation in ('favorites', 'groceries_list'):
+            with self.subTest(relation=relation):
+                getattr(recipe, relation).add(author, user)
+                getattr(recipe, relation).remove(user, other)
+                getattr(recipe, relation).clear()
+                getattr(user, relation).add(recipe, second)
+                getattr(user, relation).remove(recipe)
+                getattr(other, relation).remove(recipe, second)
+                getattr(user, relation).clear()
+                getattr(recipe, relation).set([author, other])
+                self.assertFalse(any(recount_counters().values()))
+
+
+class ShoppingListPdfTest(TestCase):
+    """
+    PDF списка покупок разбирается по таблице xref, шрифт встроен,
+    а строки не выходят за область текста страницы.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('user')
+        ingredients = [
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in (
+                'Очень длинное название ингредиента ' * 5,
+                'Щ' * 100,
+                *(f'Ёлка №{index} (ель)' for index in range(60)),
+            )
+        ]
+        recipe, = create_recipes(cls.user, 1, (), ingredients)
+        make_client(cls.user).post(f'/api/recipes/{recipe.pk}/shopping_cart/')
+
+    def test_pdf_structure(self):
+        response = make_client(self.user).get(
+            '/api/recipes/download_shopping_cart/', {'format': 'pdf'}
+        )
+        self.assertEqual(response.status_code, 200)
+        data = b''.join(response.streaming_content)
+        self.assertTrue(data.startswith(b'%PDF-1.4'))
+        xref_position = int(re.search(
+            rb'startxref\n(\d+)\n%%EOF\n$', data
+        ).group(1))
+        self.assertTrue(data[xref_position:].startswith(b'xref\n0 '))
+        size = int(data[xref_position:].split(b'\n')[1].split()[1])
+        offsets = re.findall(
+            rb'(\d{10}) 00000 n ', data[xref_position:]
+        )
+        self.assertEqual(len(offsets), size - 1)
+        objects = {}
+        for object_id, offset in enumerate(offsets, start=1):
+            body = data[int(offset):]
+            self.assertTrue(body.startswith(b'%d 0 obj\n' % object_id))
+            objects[object_id] = body[:body.index(b'\nendobj\n')]
+        pages = [body for body in objects.values() if b'/Type /Page ' in body]
+        self.assertGreater(len(pages), 1)
+        self.assertIn(b'/Count %d' % len(pages), objects[PdfWriter.PAGES_ID])
+        self.assertIn(b'/FontFile2', objects[PdfWriter.FONT_DESCRIPTOR_ID])
+
+        widths = load_pdf_font().widths
+        max_width = (
+            (PdfWriter.PAGE_WIDTH - 2 * PdfWriter.MARGIN)
+            * 1000 / PdfWriter.FONT_SIZE
+        )
+        lines = [
+            line.replace(b'\\(', b'(').replace(b'\\)', b')')
+            for body in objects.values() if b'BT /F1' in body
+            for line in re.findall(rb'\((.*?)(?<!\\)\) Tj', body)
+        ]
+        self.assertIn('Щ'.encode('cp1251') * 30, b''.join(lines))
+        for line in lines:
+            self.assertLessEqual(sum(widths[code] for code in line), max_width)
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class ParallelToggleTest(TransactionTestCase):
+    """
+    Параллельные добавления в избранное, корзину и подписки дают ровно
+    одну связь на пользователя, а счётчики совпадают с числом связей.
+    Выполняется на PostgreSQL: SQLite в памяти не допускает параллельной
+    записи из потоков.
+    """
+
+    threads = 50
+
+    def setUp(self):
+        self.author = create_user('author')
+        self.users = [
+            create_user(f'user{index}') for index in range(self.threads)
+        ]
+        ingredient = Ingredient.objects.create(
+            name='Ингредиент', measurement_unit='г'
+        )
+        self.recipe, = create_recipes(self.author, 1, (), [ingredient])
+
+    def run_parallel(self, requests):
+        """
+        Выполняет запросы одновременно, каждый в своём потоке со своим
+        соединением с базой данных. Возвращает коды ответов.
+        """
+
+        barrier = threading.Barrier(len(requests))
+        statuses = [None] * len(requests)
+
+        def run(index, user, method, url):
+            try:
+                client = make_client(user)
+                barrier.wait()
+                statuses[index] = getattr(client, method)(url).status_code
+            finally:
+                connection.close()
+
+        workers = [
+            threading.Thread(target=run, args=(index, *request))
+            for index, request in enumerate(requests)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return statuses
+
+    def test_double_clicks_create_one_favorite(self):
+        user = self.users[0]
+        url = f'/api/recipes/{self.recipe.pk}/favorite/'
+        statuses = self.run_parallel([(user, 'post', url)] * self.threads)
+        self.assertEqual(sorted(statuses), [201] + [400] * (self.threads - 1))
+        self.assertEqual(self.recipe.favorites.count(), 1)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 1)
+
+        statuses = self.run_parallel([(user, 'delete', url)] * self.threads)
+        self.assertEqual(sorted(statuses), [204] + [400] * (self.threads - 1))
+        self.assertEqual(self.recipe.favorites.count(), 0)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 0)
+
+    def test_parallel_cart_toggles(self):
+        url = f'/api/recipes/{self.recipe.pk}/shopping_cart/'
+        statuses = self.run_parallel([
+            (user, 'post', url) for user in self.users
+        ])
+        self.assertEqual(statuses, [201] * self.threads)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.in_carts_count, self.threads)
+        self.assertEqual(self.recipe.groceries_list.count(), self.threads)
+
+        # Половина пользователей убирает рецепт, другая добавляет снова.
+        statuses = self.run_parallel([
+            (user, 'delete' if index % 2 else 'post', url)
+            for index, user in enumerate(self.users)
+        ])
+        self.assertEqual(
+            sorted(statuses),
+            [204] * (self.threads // 2)
+            + [400] * (self.threads - self.threads // 2),
+        )
+        self.recipe.refresh_from_db()
+        remaining = self.threads - self.threads // 2
+        self.assertEqual(self.recipe.in_carts_count, remaining)
+        self.assertEqual(self.recipe.groceries_list.count(), remaining)
+
+    def test_parallel_subscriptions(self):
+        url = f'/api/users/{self.author.pk}/subscribe/'
+        statuses = self.run_parallel([
+            (user, 'post', url) for user in self.users
+        ])
+        self.assertEqual(statuses, [201] * self.threads)
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.subscribers_count, self.threads)
+        self.assertEqual(
+            self.author.subscribers.count(), self.threads
+        )
+
+    def assert_statements(self, num, method, url, status):
+        """
+        Как assertNumQueries, но без BEGIN и точек сохранения, которые
+        видны в запросах не на всех базах данных.
+        """
+
+        client = make_client(self.users[0])
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(client, method)(url)
+        self.assertEqual(response.status_code, status)
+        statements = [
+            query['sql'] for query in queries.captured_queries
+            if query['sql'].split(' ', 1)[0] not in TRANSACTION_STATEMENTS
+        ]
+        self.assertEqual(len(statements), num, statements)
+
+    def test_toggle_query_count(self):
+        """
+        Добавление стоит записи, обновления счётчика и чтения рецепта
+        для ответа, удаление записи и счётчика. Повторное нажатие стоит
+        записи и проверки существования рецепта.
+        """
+
+        url = f'/api/recipes/{self.recipe.pk}/favorite/'
+        self.assert_statements(3, 'post', url, 201)
+        self.assert_statements(2, 'post', url, 400)
+        self.assert_statements(2, 'delete', url, 204)
+        self.assert_statements(2, 'delete', url, 400)
@@ -1,39 +1,49 @@
-from datetime import datetime
-
-from django.db.models import BooleanField, Case, F, Sum, Value, When
-from django.db.models.functions import Coalesce
-from django.http import Http404, HttpResponse
-from django.shortcuts import get_object_or_404
+from django.conf import settings
+from django.db.models import BooleanField, Exists, OuterRef, Prefetch, Value
+from django.http import Http404, StreamingHttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import filters, permissions, status, viewsets
 from rest_framework.decorators import action
-from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+from rest_framework_simplejwt.settings import api_settings
 from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.utils import datetime_from_epoch
 
+from recipes.ingredient_index import ingredient_index
 from recipes.models import Ingredient, Recipe, RecipesIngredients, Tag
-from users.models import Subscription, User
-
-from .filters import IngredientFilter, RecipeFilter
-from .pagination import UserPageNumberPagination
+from recipes.services import (add_favorite, add_many_favorites,
+                              add_many_to_cart, add_to_cart, remove_favorite,
+                              remove_from_cart, remove_many_favorites,
+                              remove_many_from_cart, subscribe, unsubscribe)
+from users.models import User
+from users.token_deny_list import token_deny_list
+
+from .cache import (FEED, AnonymousResponseCacheMixin, author_scope,
+                    recipe_scope, tag_scope)
+from .filters import IngredientFilter, RecipeFilter, RecipeSearchFilter
+from .pagination import RecipeCursorPagination, UserPageNumberPagination
 from .permissions import IsAdmin, IsAdminOrReadOnly, SafeMethodOrAuthor
+from .profiling import ProfilingMixin
 from .serializers import (IngredientSerializer, RecipeBriefSerializer,
-                          RecipesSerializer, TagSerializer,
-                          UserBasicSerializer, UserCreateSerializer,
-                          UserNewPasswordSerializer,
+                          RecipeIdsSerializer, RecipesSerializer,
+                          TagSerializer, UserBasicSerializer,
+                          UserCreateSerializer, UserNewPasswordSerializer,
                           UserSubscriptionsSerializer)
+from .shopping_list import (SHOPPING_LIST_RENDERERS,
+                            ShoppingListContentNegotiation,
+                            render_shopping_list)
 
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(ProfilingMixin, viewsets.ModelViewSet):
     """
     Вьюсет для модели User.
     """
 
     permission_classes = (permissions.AllowAny,)
-    queryset = User.objects.all()
+    queryset = User.objects.order_by('id')
     http_method_names = ['get', 'post', 'put', 'delete']
     pagination_class = UserPageNumberPagination
 
@@ -75,15 +85,10 @@ class UserViewSet(viewsets.ModelViewSet):
         Эндпоинт me для модели User. Показывает текущего пользователя.
         """
 
-        user = request.user
         serializer = UserBasicSerializer(
-            user,
-            data=request.data, partial=True, context={'request': request}
+            request.user, context={'request': request}
         )
-        if serializer.is_valid():
-            serializer.save()
-            return Response(serializer.data)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        return Response(serializer.data)
 
     @action(
         detail=False, methods=['POST'],
@@ -159,7 +164,11 @@ class UserViewSet(viewsets.ModelViewSet):
         """
 
         user = request.user
-        user_subscriptions = User.objects.filter(subscribers__user=user)
+        user_subscriptions = User.objects.filter(
+            subscribers__user=user
+        ).annotate(
+            is_subscribed=Value(True, output_field=BooleanField()),
+        ).order_by('id')
         paginator = self.pagination_class()
         user_subscriptions_paginated = paginator.paginate_queryset(
             user_subscriptions, request
@@ -180,36 +189,32 @@ class SubscribeUserAPIView(APIView):
 
     def post(self, request, pk=None):
         user = request.user
-        subscription = get_object_or_404(User, pk=pk)
-        user_subscriptions = Subscription.objects.filter(
-            user=user, subscription=subscription
-        )
-        if user == subscription:
+        if str(user.pk) == str(pk):
             return Response(
                 {"detail": 'Вы не можете подписаться на самого себя.'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        if user_subscriptions.exists():
+        created = subscribe(user.pk, pk)
+        if created is None:
+            raise Http404
+        if not created:
             return Response(
                 {"detail": 'Вы уже подписаны на данного пользователя'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        Subscription.objects.create(
-            user=request.user, subscription=subscription
-        )
+        subscription = User.objects.annotate(
+            is_subscribed=Value(True, output_field=BooleanField())
+        ).get(pk=pk)
         serializer = UserSubscriptionsSerializer(
             subscription, context={'request': request},
         )
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     def delete(self, request, pk=None):
-        user = request.user
-        subscription = get_object_or_404(User, pk=pk)
-        user_subscriptions = Subscription.objects.filter(
-            user=user, subscription=subscription
-        )
-        if user_subscriptions.exists():
-            user_subscriptions.delete()
+        deleted = unsubscribe(request.user.pk, pk)
+        if deleted is None:
+            raise Http404
+        if deleted:
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response(
             {"detail": 'Вы не подписаны на этого пользователя'},
@@ -229,7 +234,10 @@ class TokenLogoutView(APIView):
             access_token = request.auth
             refresh_token = request.data.get('refresh_token')
             if access_token:
-                OutstandingToken.objects.filter(token=access_token).delete()
+                token_deny_list.revoke(
+                    access_token[api_settings.JTI_CLAIM],
+                    datetime_from_epoch(access_token['exp']),
+                )
             if refresh_token:
                 RefreshToken(refresh_token).blacklist()
         except Exception:
@@ -251,7 +259,9 @@ class TagViewSet(viewsets.ModelViewSet):
     pagination_class = None
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(
+    ProfilingMixin, AnonymousResponseCacheMixin, viewsets.ModelViewSet
+):
     """
     Вьюсет для модели Recipe.
     """
@@ -259,60 +269,114 @@ class RecipeViewSet(viewsets.ModelViewSet):
     permission_classes = (SafeMethodOrAuthor | IsAdminOrReadOnly,)
     serializer_class = RecipesSerializer
     pagination_class = UserPageNumberPagination
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter]
+    filter_backends = [DjangoFilterBackend, RecipeSearchFilter]
     filterset_class = RecipeFilter
+    lookup_value_regex = r'\d+'
+    cache_query_params = (
+        'page', 'limit', 'cursor', 'tags', 'author', 'is_favorited',
+        'is_in_shopping_cart', 'search',
+    )
+
+    def get_cache_scopes(self, request, params):
+        """
+        Рецепт зависит от своей версии, лента автора от версии автора,
+        выборка по тегам от версий этих тегов, остальные списки от
+        версии всей ленты.
+        """
+
+        if self.action == 'retrieve':
+            return [recipe_scope(int(self.kwargs['pk']))]
+        if 'author' in params:
+            author = params['author']
+            if len(author) != 1 or not author[0].isdigit():
+                return None
+            return [author_scope(int(author[0]))]
+        if 'tags' in params:
+            return [tag_scope(slug) for slug in params['tags']]
+        return [FEED]
+
+    @property
+    def paginator(self):
+        """
+        Keyset-пагинация по (pub_date, id) включается параметром cursor,
+        без него работает прежняя пагинация page/limit.
+        """
+
+        if not hasattr(self, '_paginator'):
+            if RecipeCursorPagination.cursor_query_param in (
+                self.request.query_params
+            ):
+                self._paginator = RecipeCursorPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
 
     def get_queryset(self):
         """
         Дополнительно аннотируем к queryset поля is_favorited и
         is_in_shopping_cart, которые нужны будут для других методов и функций.
+        Флаги считаются коррелированными EXISTS-подзапросами по индексу
+        (recipe_id, user_id) связанных таблиц, поэтому каждый рецепт
+        попадает в выборку ровно один раз. Для анонимного пользователя
+        подзапросы не нужны, флаги всегда False.
         Также фэтчим и селектим tags, ingredients, author для оптимизации
-        SQL запросов к базе данных.
+        SQL запросов к базе данных. Строки RecipesIngredients всей страницы
+        загружаются одним запросом вместе с ингредиентами.
         """
         user = self.request.user
-        queryset = Recipe.objects.annotate(
-            is_favorited=Case(
-                When(favorites__pk=user.pk, then=Value(True)),
-                default=Value(False),
-                output_field=BooleanField()
-            ),
-            is_in_shopping_cart=Case(
-                When(groceries_list__pk=user.pk, then=Value(True)),
-                default=Value(False),
-                output_field=BooleanField()
+        if user.is_authenticated:
+            favorites = Recipe.favorites.through.objects.filter(
+                recipe=OuterRef('pk'), user=user
             )
-        ).prefetch_related('tags', 'ingredients').select_related('author')
-        return queryset
+            groceries_list = Recipe.groceries_list.through.objects.filter(
+                recipe=OuterRef('pk'), user=user
+            )
+            queryset = Recipe.objects.annotate(
+                is_favorited=Exists(favorites),
+                is_in_shopping_cart=Exists(groceries_list),
+            )
+        else:
+            queryset = Recipe.objects.annotate(
+                is_favorited=Value(False, output_field=BooleanField()),
+                is_in_shopping_cart=Value(False, output_field=BooleanField()),
+            )
+        return queryset.prefetch_related(
+            'tags',
+            Prefetch(
+                'ingredient',
+                queryset=RecipesIngredients.objects.select_related(
+                    'ingredient'
+                ),
+            ),
+        ).select_related('author')
 
-    def cart_favorite_method(self, pk, table):
+    def cart_favorite_method(self, pk, link):
         """
         Функция для сокращения однотипного кода для эндпоинта shopping_cart
-        и favorite.
+        и favorite. Связь создаётся одной командой, которая ничего не
+        делает, если рецепт уже добавлен.
         """
-        
-        try:
-            recipe = Recipe.objects.get(pk=pk)
-        except Http404:
-            raise ValidationError
-        relation = table.filter(pk=recipe.pk)
-        if relation.exists():
+
+        created = link(self.request.user.pk, pk)
+        if created is None:
+            raise Http404
+        if not created:
             return Response(
                 status=status.HTTP_400_BAD_REQUEST
             )
-        table.add(recipe)
-        serializer = RecipeBriefSerializer(recipe)
+        serializer = RecipeBriefSerializer(Recipe.objects.get(pk=pk))
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-    def cart_favorite_method_delete(self, pk, table):
+    def cart_favorite_method_delete(self, pk, unlink):
         """
         Функция для сокращения однотипного кода для эндпоинта shopping_cart
         и favorite где применён метод DELETE.
         """
 
-        recipe = get_object_or_404(Recipe, pk=pk)
-        relation = table.filter(pk=recipe.pk)
-        if relation.exists():
-            table.remove(recipe)
+        deleted = unlink(self.request.user.pk, pk)
+        if deleted is None:
+            raise Http404
+        if deleted:
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response(
             status=status.HTTP_400_BAD_REQUEST
@@ -328,9 +392,7 @@ class RecipeViewSet(viewsets.ModelViewSet):
         куда он может добавлять рецепты.
         """
 
-        user = request.user
-        pk = kwargs.get('pk')
-        return self.cart_favorite_method(pk, user.groceries_list)
+        return self.cart_favorite_method(kwargs.get('pk'), add_to_cart)
 
     @shopping_cart.mapping.delete
     def delete_shopping_cart(self, request, *args, **kwargs):
@@ -338,9 +400,9 @@ class RecipeViewSet(viewsets.ModelViewSet):
         Метод DELETE для эндпоинта shopping_cart.
         """
 
-        user = request.user
-        pk = kwargs.get('pk')
-        return self.cart_favorite_method_delete(pk, user.groceries_list)
+        return self.cart_favorite_method_delete(
+            kwargs.get('pk'), remove_from_cart
+        )
 
     @action(
         detail=True, methods=['POST'],
@@ -352,9 +414,7 @@ class RecipeViewSet(viewsets.ModelViewSet):
         куда он может добавлять рецепты.
         """
 
-        user = request.user
-        pk = kwargs.get('pk')
-        return self.cart_favorite_method(pk, user.favorites)
+        return self.cart_favorite_method(kwargs.get('pk'), add_favorite)
 
     @favorite.mapping.delete
     def delete_favorite(self, request, *args, **kwargs):
@@ -362,50 +422,124 @@ class RecipeViewSet(viewsets.ModelViewSet):
         Метод DELETE для эндпоинта favorite.
         """
 
-        user = request.user
-        pk = kwargs.get('pk')
-        return self.cart_favorite_method_delete(pk, user.favorites)
+        return self.cart_favorite_method_delete(
+            kwargs.get('pk'), remove_favorite
+        )
+
+    def bulk_relation_method(self, request, change, statuses,
+                             allow_all=False):
+        """
+        Функция для сокращения однотипного кода для пакетных эндпоинтов
+        shopping_cart и favorite. Все изменения применяются одной командой
+        в транзакции, результат возвращается по каждому id.
+        """
+
+        serializer = RecipeIdsSerializer(
+            data=request.data, context={'allow_all': allow_all}
+        )
+        serializer.is_valid(raise_exception=True)
+        recipe_ids = serializer.validated_data.get('recipes')
+        changed, unchanged, missing = change(request.user.pk, recipe_ids)
+        if recipe_ids is None:
+            recipe_ids = sorted(changed)
+        results = []
+        for recipe_id in recipe_ids:
+            if recipe_id in changed:
+                result = statuses[0]
+            elif recipe_id in unchanged:
+                result = statuses[1]
+            else:
+                result = 'not_found'
+            results.append({'id': recipe_id, 'status': result})
+        return Response({'results': results}, status=status.HTTP_200_OK)
+
+    @action(
+        detail=False, methods=['POST'], url_path='shopping_cart',
+        url_name='bulk-shopping-cart', permission_classes=(IsAuthenticated,)
+    )
+    def bulk_shopping_cart(self, request, *args, **kwargs):
+        """
+        Пакетное добавление рецептов в корзину: {"recipes": [id, ...]}.
+        """
+
+        return self.bulk_relation_method(
+            request, add_many_to_cart, ('added', 'already_added')
+        )
+
+    @bulk_shopping_cart.mapping.delete
+    def bulk_delete_shopping_cart(self, request, *args, **kwargs):
+        """
+        Пакетное удаление рецептов из корзины: {"recipes": [id, ...]}
+        или {"all": true} для очистки корзины целиком.
+        """
+
+        return self.bulk_relation_method(
+            request, remove_many_from_cart, ('removed', 'not_added'),
+            allow_all=True,
+        )
+
+    @action(
+        detail=False, methods=['POST'], url_path='favorite',
+        url_name='bulk-favorite', permission_classes=(IsAuthenticated,)
+    )
+    def bulk_favorite(self, request, *args, **kwargs):
+        """
+        Пакетное добавление рецептов в избранное: {"recipes": [id, ...]}.
+        """
+
+        return self.bulk_relation_method(
+            request, add_many_favorites, ('added', 'already_added')
+        )
+
+    @bulk_favorite.mapping.delete
+    def bulk_delete_favorite(self, request, *args, **kwargs):
+        """
+        Пакетное удаление рецептов из избранного: {"recipes": [id, ...]}
+        или {"all": true} для очистки избранного целиком.
+        """
+
+        return self.bulk_relation_method(
+            request, remove_many_favorites, ('removed', 'not_added'),
+            allow_all=True,
+        )
+
+    def handle_exception(self, exc):
+        """
+        Рендереры списка покупок описывают формат файла, поэтому ошибки
+        download_shopping_cart рендерятся в JSON с его типом содержимого.
+        """
+
+        response = super().handle_exception(exc)
+        if self.action == 'download_shopping_cart':
+            self.request.accepted_renderer = JSONRenderer()
+            self.request.accepted_media_type = JSONRenderer.media_type
+        return response
 
     @action(
         detail=False, methods=['GET'],
-        permission_classes=(IsAuthenticated,)
+        permission_classes=(IsAuthenticated,),
+        renderer_classes=SHOPPING_LIST_RENDERERS,
+        content_negotiation_class=ShoppingListContentNegotiation,
     )
     def download_shopping_cart(self, request, *args, **kwargs):
         """
         Эндпоинт download_shopping_cart, позволяет скачивать список
-        ингредиентов для покупки в формате .txt на основе
-        рецептов в корзине пользователя.
+        ингредиентов для покупки на основе рецептов в корзине пользователя.
+        Формат выбирается параметром ?format=txt|csv|json|pdf, по умолчанию
+        txt. Файл отдаётся потоком по мере чтения строк из базы данных.
+        Ошибки, в том числе 406 для неизвестного формата, отдаются в JSON.
         """
 
-        user = request.user
-        current_date = datetime.now().strftime("%Y-%m-%d")
-        user_ingredients = (
-            RecipesIngredients.objects
-            .filter(recipe__groceries_list=user)
-            .values(
-                ingredient_name=F('ingredient__name'),
-                measurement_unit=F('ingredient__measurement_unit')
-            )
-            .annotate(
-                total_amount=Coalesce(Sum('amount'), Value(0)),
-            )
-        )
-        content = (
-            f"{user.username}, Ваш список покупок на {current_date}\n\n\n"
-        )
-        for ingredient in user_ingredients:
-            content += (
-                f"{ingredient['ingredient_name']}"
-                f"({ingredient['measurement_unit']}) — "
-                f"{ingredient['total_amount']}\n"
-            )
-        content += (
-            '\n\n\nСформировано на сайте '
-            'www.iceadmin.ru, проект Foodgram'
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(
+            render_shopping_list(request.user, renderer.format),
+            content_type=(
+                f'{renderer.media_type}; charset={renderer.charset}'
+                if renderer.charset else renderer.media_type
+            ),
         )
-        response = HttpResponse(content, content_type='text/plain')
         response['Content-Disposition'] = (
-            'attachment; filename="shopping_list.txt"'
+            f'attachment; filename="shopping_list.{renderer.format}"'
         )
         return response
 
@@ -421,3 +555,16 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     pagination_class = None
     filter_backends = [DjangoFilterBackend, filters.SearchFilter]
     filterset_class = IngredientFilter
+
+    def list(self, request, *args, **kwargs):
+        """
+        Автодополнение по ?name= отвечает из индекса в памяти без запросов
+        к базе данных, количество результатов ограничено.
+        """
+
+        name = request.query_params.get('name')
+        if not name:
+            return super().list(request, *args, **kwargs)
+        return Response(
+            ingredient_index.search(name, settings.INGREDIENT_SEARCH_LIMIT)
+        )
@@ -0,0 +1,62 @@
+"""
+Метрики Prometheus. Под gunicorn значения пишутся в файлы каталога
+PROMETHEUS_MULTIPROC_DIR, а /metrics собирает их со всех воркеров.
+Без этой переменной используется обычный реестр процесса.
+"""
+
+import os
+
+from django.http import HttpResponse
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY,
+                               CollectorRegistry, Counter, Histogram,
+                               generate_latest, multiprocess)
+
+REQUEST_COUNT = Counter(
+    'foodgram_http_requests_total',
+    'Запросы по маршруту, методу и коду ответа.',
+    ['route', 'method', 'status'],
+)
+REQUEST_LATENCY = Histogram(
+    'foodgram_http_request_duration_seconds',
+    'Время обработки запроса.',
+    ['route', 'method'],
+    buckets=(
+        0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+    ),
+)
+RESPONSE_SIZE = Histogram(
+    'foodgram_http_response_size_bytes',
+    'Размер тела ответа.',
+    ['route'],
+    buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304),
+)
+DB_QUERIES = Histogram(
+    'foodgram_db_queries_per_request',
+    'Число SQL запросов за один HTTP запрос.',
+    ['route'],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100),
+)
+DB_DURATION = Histogram(
+    'foodgram_db_duration_seconds',
+    'Суммарное время SQL запросов за один HTTP запрос.',
+    ['route'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+)
+AUTH_CACHE_LOOKUPS = Counter(
+    'foodgram_auth_user_cache_lookups_total',
+    'Поиски пользователя в кеше аутентификации.',
+    ['result'],
+)
+AUTH_CACHE_HITS = AUTH_CACHE_LOOKUPS.labels(result='hit')
+AUTH_CACHE_MISSES = AUTH_CACHE_LOOKUPS.labels(result='miss')
+
+
+def metrics_view(request):
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(
+        generate_latest(registry), content_type=CONTENT_TYPE_LATEST
+    )
@@ -29,6 +29,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'django_filters',
     'rest_framework',
     'rest_framework_simplejwt',
@@ -38,6 +39,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -45,6 +47,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.middleware.RequestTimingMiddleware',
 ]
 
 ROOT_URLCONF = 'backend.urls'
@@ -82,6 +85,16 @@ DATABASES = {
     }
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.filebased.FileBasedCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', '/tmp/foodgram_cache'),
+    }
+}
+
 AUTH_USER_MODEL = "users.User"
 
 # Password validation
@@ -138,7 +151,7 @@ REST_FRAMEWORK = {
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.CachedJWTAuthentication',
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
 }
@@ -146,4 +159,46 @@ REST_FRAMEWORK = {
 SIMPLE_JWT = {
    'ACCESS_TOKEN_LIFETIME': timedelta(days=1),
    'AUTH_HEADER_TYPES': ('Token',),
-} 
\ No newline at end of file
+}
+
+INGREDIENT_SEARCH_LIMIT = 50
+
+AUTH_USER_CACHE_SIZE = 10000
+AUTH_USER_CACHE_TTL = 300
+
+TOKEN_DENY_LIST_MIN_CAPACITY = 1024
+TOKEN_DENY_LIST_REBUILD_INTERVAL = 60 * 60
+
+REQUEST_TIMING_ENABLED = os.getenv('REQUEST_TIMING_ENABLED') == 'True'
+REQUEST_TIMING_SAMPLE_RATE = float(
+    os.getenv('REQUEST_TIMING_SAMPLE_RATE', 0.01)
+)
+REQUEST_TIMING_REPEATED_QUERY_THRESHOLD = 3
+
+PROFILING_DIR = os.getenv('PROFILING_DIR', '/tmp/foodgram_profiles')
+PROFILING_MAX_PROFILES = 50
+PROFILING_SAMPLE_INTERVAL = 0.001
+PROFILING_STATS_LIMIT = 60
+PROFILING_EXPLAIN_LIMIT = 5
+
+RESPONSE_CACHE_ENABLED = (
+    os.getenv('RESPONSE_CACHE_ENABLED', 'True') == 'True'
+)
+RESPONSE_CACHE_TIMEOUT = 60 * 60
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'api.timing': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
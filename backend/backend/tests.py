@@ -0,0 +1,49 @@
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.test import SimpleTestCase
+
+# Повторяет то, что делает gunicorn: мастер читает конфиг и вызывает
+# on_starting, воркер после fork загружает приложение и пишет метрики.
+# Выполняется в отдельном интерпретаторе без PROMETHEUS_MULTIPROC_DIR.
+# Конфиг не должен импортировать prometheus_client, тогда каталог
+# можно заменить временным до импорта.
+GUNICORN_WORKER_SCRIPT = '''
+import os
+import runpy
+import sys
+
+config = runpy.run_path('gunicorn.conf.py')
+assert 'prometheus_client' not in sys.modules
+os.environ['PROMETHEUS_MULTIPROC_DIR'] = sys.argv[1]
+config['on_starting'](None)
+pid = os.fork()
+if pid == 0:
+    from backend.metrics import REQUEST_COUNT
+    REQUEST_COUNT.labels('test', 'GET', 200).inc()
+    os._exit(0)
+os.waitpid(pid, 0)
+print(pid)
+'''
+
+
+class GunicornMetricsTest(SimpleTestCase):
+
+    def test_worker_writes_multiprocess_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            env = {
+                name: value for name, value in os.environ.items()
+                if name != 'PROMETHEUS_MULTIPROC_DIR'
+            }
+            result = subprocess.run(
+                [sys.executable, '-c', GUNICORN_WORKER_SCRIPT, directory],
+                cwd=settings.BASE_DIR, env=env, check=True,
+                capture_output=True, text=True,
+            )
+            pid = result.stdout.strip()
+            files = sorted(path.name for path in Path(directory).glob('*.db'))
+            self.assertIn(f'counter_{pid}.db', files)
@@ -0,0 +1,43 @@
+import glob
+import os
+import shutil
+
+# Воркеры пишут метрики в файлы этого каталога, /metrics их суммирует.
+# prometheus_client выбирает хранилище значений при первом импорте,
+# поэтому переменная задаётся до него, а сам клиент импортируется
+# только в хуках.
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/prometheus')
+
+bind = '0.0.0.0:8000'
+
+
+def on_starting(server):
+    """
+    Удаляет файлы метрик прошлого запуска, иначе счётчики мёртвых
+    воркеров попадут в новые значения.
+    """
+
+    directory = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+
+
+def post_worker_init(worker):
+    """
+    Метрики создаются при загрузке приложения, поэтому у воркера уже
+    должны быть свои файлы. Если их нет, /metrics не увидит его данных.
+    """
+
+    directory = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    if not glob.glob(os.path.join(directory, f'*_{worker.pid}.db')):
+        worker.log.error(
+            'Воркер %s не пишет метрики в %s: prometheus_client '
+            'импортирован до установки PROMETHEUS_MULTIPROC_DIR.',
+            worker.pid, directory,
+        )
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
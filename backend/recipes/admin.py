@@ -1,24 +1,112 @@
 from django.contrib import admin
 
 from .models import Ingredient, Recipe, RecipesIngredients, Tag
+from .paginators import EstimatedCountPaginator
+from .signals import recipe_changed
 
 
 class RecipeAdmin(admin.ModelAdmin):
-    list_display = ('name', 'author', 'favorites_count')
-    list_filter = ('author', 'name', 'tags__name',)
+    list_display = ('name', 'author', 'favorites_count', 'pub_date')
+    list_filter = ('tags',)
+    list_select_related = ('author',)
+    search_fields = ('^name', '=author__username')
+    autocomplete_fields = ('author',)
+    raw_id_fields = ('favorites', 'groceries_list')
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
 
-    def favorites_count(self, obj):
-        return obj.favorites.count()
+    def save_related(self, request, form, formsets, change):
+        """
+        Теги сохраняются после рецепта, поэтому об изменении рецепта
+        сообщается здесь, как это делает API.
+        """
 
-    favorites_count.short_description = 'Добовлено в избранное количество раз'
+        old_tag_ids = {tag.pk for tag in form.initial.get('tags', [])}
+        super().save_related(request, form, formsets, change)
+        tags = list(form.cleaned_data['tags'])
+        tag_ids = {tag.pk for tag in tags}
+        recipe_changed.send(
+            sender=Recipe,
+            recipe=form.instance,
+            created=not change,
+            ingredient_changes={},
+            tags=tags,
+            tags_added=tag_ids - old_tag_ids,
+            tags_removed=old_tag_ids - tag_ids,
+        )
 
 
 class IngredientAdmin(admin.ModelAdmin):
     list_display = ('name', 'measurement_unit',)
-    list_filter = ('name',)
+    list_filter = ('measurement_unit',)
+    search_fields = ('^name',)
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+
+
+def send_ingredient_changes(changes):
+    """
+    Сообщает об изменении ингредиентов рецептов, сделанном мимо API:
+    changes это {recipe_id: {ingredient_id: (old_amount, new_amount)}}.
+    """
+
+    recipes = Recipe.objects.prefetch_related('tags').in_bulk(changes)
+    for recipe_id, ingredient_changes in changes.items():
+        recipe = recipes.get(recipe_id)
+        if recipe is None:
+            continue
+        recipe_changed.send(
+            sender=Recipe,
+            recipe=recipe,
+            created=False,
+            ingredient_changes=ingredient_changes,
+            tags=list(recipe.tags.all()),
+            tags_added=set(),
+            tags_removed=set(),
+        )
+
+
+class RecipesIngredientsAdmin(admin.ModelAdmin):
+    list_display = ('recipe', 'ingredient', 'amount')
+    list_select_related = ('recipe', 'ingredient')
+    raw_id_fields = ('recipe', 'ingredient')
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+
+    def save_model(self, request, obj, form, change):
+        """
+        Строку можно перенести в другой рецепт или заменить ингредиент,
+        тогда старый ингредиент удаляется из старого рецепта.
+        """
+
+        super().save_model(request, obj, form, change)
+        changes = {}
+        if change:
+            changes[form.initial['recipe']] = {
+                form.initial['ingredient']: (form.initial['amount'], None)
+            }
+        recipe_changes = changes.setdefault(obj.recipe_id, {})
+        old_amount, _ = recipe_changes.get(obj.ingredient_id, (None, None))
+        recipe_changes[obj.ingredient_id] = (old_amount, obj.amount)
+        send_ingredient_changes(changes)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        send_ingredient_changes(
+            {obj.recipe_id: {obj.ingredient_id: (obj.amount, None)}}
+        )
+
+    def delete_queryset(self, request, queryset):
+        changes = {}
+        for recipe_id, ingredient_id, amount in queryset.values_list(
+            'recipe_id', 'ingredient_id', 'amount'
+        ):
+            changes.setdefault(recipe_id, {})[ingredient_id] = (amount, None)
+        super().delete_queryset(request, queryset)
+        send_ingredient_changes(changes)
 
 
 admin.site.register(Tag)
 admin.site.register(Recipe, RecipeAdmin)
 admin.site.register(Ingredient, IngredientAdmin)
-admin.site.register(RecipesIngredients)
+admin.site.register(RecipesIngredients, RecipesIngredientsAdmin)
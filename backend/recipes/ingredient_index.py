@@ -0,0 +1,102 @@
+import threading
+import uuid
+from bisect import bisect_left
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Ingredient
+
+VERSION_CACHE_KEY = 'ingredient_index_version'
+
+
+class IngredientPrefixIndex:
+    """
+    Индекс ингредиентов в памяти процесса для автодополнения по началу
+    названия. Названия хранятся отсортированными в casefold, поиск
+    префикса делается бинарным поиском. Индекс строится при первом
+    обращении. Версия индекса хранится в кеше, поэтому сброс в одном
+    процессе (сигналы, load_csv) перестраивает индекс во всех воркерах.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    def invalidate(self):
+        """
+        Сбрасывает индекс после коммита транзакции. Иначе другой воркер
+        успел бы перестроить индекс по новой версии из старых данных и
+        держал бы его до следующего сброса.
+        """
+
+        transaction.on_commit(self._reset)
+
+    def _reset(self):
+        self._snapshot = None
+        cache.set(VERSION_CACHE_KEY, uuid.uuid4().hex, None)
+
+    def _build(self, version):
+        entries = sorted(
+            (name.casefold(), pk, name, measurement_unit)
+            for pk, name, measurement_unit in Ingredient.objects.values_list(
+                'id', 'name', 'measurement_unit'
+            )
+        )
+        keys = [entry[0] for entry in entries]
+        ingredients = [
+            {'id': pk, 'name': name, 'measurement_unit': measurement_unit}
+            for _, pk, name, measurement_unit in entries
+        ]
+        return version, keys, ingredients
+
+    def _get_version(self):
+        """
+        Версия создаётся, если её нет в кеше, например после вытеснения:
+        тогда все воркеры перестраивают индекс по новой версии.
+        """
+
+        version = cache.get(VERSION_CACHE_KEY)
+        if version is None:
+            cache.add(VERSION_CACHE_KEY, uuid.uuid4().hex, None)
+            version = cache.get(VERSION_CACHE_KEY)
+        return version
+
+    def _get_snapshot(self):
+        version = self._get_version()
+        snapshot = self._snapshot
+        if (
+            version is not None
+            and snapshot is not None
+            and snapshot[0] == version
+        ):
+            return snapshot
+        with self._lock:
+            snapshot = self._snapshot
+            if (
+                version is None
+                or snapshot is None
+                or snapshot[0] != version
+            ):
+                snapshot = self._snapshot = self._build(version)
+        return snapshot
+
+    def search(self, prefix, limit):
+        """
+        Возвращает не больше limit ингредиентов, название которых
+        начинается с prefix без учёта регистра, в алфавитном порядке.
+        """
+
+        _, keys, ingredients = self._get_snapshot()
+        prefix = prefix.casefold()
+        start = bisect_left(keys, prefix)
+        stop = min(start + limit, len(keys))
+        results = []
+        for position in range(start, stop):
+            if not keys[position].startswith(prefix):
+                break
+            results.append(ingredients[position])
+        return results
+
+
+ingredient_index = IngredientPrefixIndex()
@@ -0,0 +1,151 @@
+"""
+Общие сценарии запросов к API для команд check_query_plans
+и benchmark_api: списочные эндпоинты на данных, которые уже есть в базе.
+"""
+from collections import namedtuple
+
+from django.contrib.auth import get_user_model
+from rest_framework.test import APIClient
+
+from recipes.models import Ingredient, Recipe, Tag
+
+User = get_user_model()
+
+PIXEL_PNG = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAA'
+    'DUlEQVR42mP8z8BQDwAEhQGAhKmMIQAAAABJRU5ErkJggg=='
+)
+
+Scenario = namedtuple(
+    'Scenario', ['name', 'path', 'authenticated', 'method', 'data'],
+    defaults=('get', None),
+)
+
+
+def get_scenario_user(user_id=None):
+    """
+    Пользователь, от имени которого выполняются сценарии: заданный
+    или тот, у кого больше всего подписок.
+    """
+
+    if user_id is not None:
+        return User.objects.filter(pk=user_id).first()
+    return User.objects.order_by('-subscriptions_count', 'id').first()
+
+
+def get_scenarios():
+    author = User.objects.order_by('-recipes_count', 'id').first()
+    tag = Tag.objects.order_by('id').first()
+    recipe = Recipe.objects.order_by('-favorites_count', 'id').first()
+    scenarios = [
+        Scenario('recipes', '/api/recipes/', False),
+        Scenario('recipes_auth', '/api/recipes/', True),
+        Scenario('recipes_last_page', '/api/recipes/?page=last', False),
+        Scenario('recipes_cursor', '/api/recipes/?cursor=&limit=6', False),
+        Scenario(
+            'recipes_favorited', '/api/recipes/?is_favorited=1', True
+        ),
+        Scenario(
+            'recipes_in_cart', '/api/recipes/?is_in_shopping_cart=1', True
+        ),
+        Scenario('users', '/api/users/', False),
+        Scenario('subscriptions', '/api/users/subscriptions/', True),
+        Scenario(
+            'download_shopping_cart',
+            '/api/recipes/download_shopping_cart/', True
+        ),
+        Scenario('ingredients_prefix', '/api/ingredients/?name=а', False),
+    ]
+    if author is not None:
+        scenarios.append(Scenario(
+            'recipes_by_author', f'/api/recipes/?author={author.pk}', False
+        ))
+    if tag is not None:
+        scenarios.append(Scenario(
+            'recipes_by_tag', f'/api/recipes/?tags={tag.slug}', False
+        ))
+    if recipe is not None:
+        scenarios.append(Scenario(
+            'recipe_detail', f'/api/recipes/{recipe.pk}/', True
+        ))
+        word = recipe.name.split()[0] if recipe.name.split() else ''
+        if word:
+            scenarios.append(Scenario(
+                'recipes_search', f'/api/recipes/?search={word}', False
+            ))
+    return scenarios
+
+
+def get_write_scenarios(clients):
+    """
+    Сценарии создания и изменения рецепта. Для изменения заранее
+    создаётся рецепт от имени пользователя сценариев.
+    """
+
+    tag_ids = list(Tag.objects.order_by('id').values_list('id', flat=True)[:2])
+    ingredient_ids = Ingredient.objects.order_by('id').values_list(
+        'id', flat=True
+    )
+    data = {
+        'name': 'Рецепт для замеров',
+        'text': 'Описание рецепта для замеров.',
+        'cooking_time': 30,
+        'image': PIXEL_PNG,
+        'tags': tag_ids,
+        'ingredients': [
+            {'id': ingredient_id, 'amount': 10}
+            for ingredient_id in ingredient_ids[:10]
+        ],
+    }
+    response, _ = run_scenario(
+        clients, Scenario('setup', '/api/recipes/', True, 'post', data)
+    )
+    if response.status_code != 201:
+        return []
+    update_data = {
+        **data,
+        'ingredients': [
+            {'id': ingredient_id, 'amount': 20}
+            for ingredient_id in ingredient_ids[5:15]
+        ],
+    }
+    return [
+        Scenario('recipe_create', '/api/recipes/', True, 'post', data),
+        Scenario(
+            'recipe_update', f'/api/recipes/{response.data["id"]}/', True,
+            'patch', update_data,
+        ),
+    ]
+
+
+def make_clients(user):
+    """
+    Клиенты для анонимных и авторизованных сценариев. SERVER_NAME берётся
+    из ALLOWED_HOSTS, чтобы запросы проходили на боевых настройках.
+    """
+
+    anonymous = APIClient(SERVER_NAME='localhost')
+    authenticated = APIClient(SERVER_NAME='localhost')
+    authenticated.force_authenticate(user)
+    return anonymous, authenticated
+
+
+def run_scenario(clients, scenario):
+    """
+    Выполняет запрос сценария и дочитывает потоковый ответ целиком.
+    Возвращает ответ и размер тела в байтах.
+    """
+
+    anonymous, authenticated = clients
+    client = authenticated if scenario.authenticated else anonymous
+    if scenario.method == 'get':
+        response = client.get(scenario.path)
+    else:
+        response = getattr(client, scenario.method)(
+            scenario.path, scenario.data, format='json'
+        )
+    if response.streaming:
+        size = sum(len(chunk) for chunk in response.streaming_content)
+    else:
+        size = len(response.content)
+    return response, size
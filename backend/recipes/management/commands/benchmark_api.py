@@ -0,0 +1,243 @@
+import gc
+import io
+import json
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from api.middleware import QueryCounter
+
+from ._scenarios import (get_scenario_user, get_scenarios, get_write_scenarios,
+                         make_clients, run_scenario)
+
+BASELINE_FILE = settings.BASE_DIR / 'benchmarks' / 'baseline.json'
+LATENCY_SLACK_MS = 5.0
+MEMORY_SLACK_KB = 64.0
+MEMORY_RUNS = 3
+BENCHMARK_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'benchmark_api',
+    },
+}
+
+
+def percentile(samples, percent):
+    if len(samples) == 1:
+        return samples[0]
+    return statistics.quantiles(samples, n=100)[percent - 1]
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеры эндпоинтов API на синтетических данных нескольких размеров '
+        'во временной тестовой базе: p50/p95/p99, число запросов, время SQL '
+        'и пик памяти. Результаты сравниваются с базовой линией, команда '
+        'падает при регрессии больше порога.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', type=int, nargs='+', default=[1000, 10000],
+            help='Количества рецептов, на которых проводятся замеры'
+        )
+        parser.add_argument(
+            '--recipes-per-user', type=int, default=20,
+            help='Сколько рецептов приходится на одного пользователя'
+        )
+        parser.add_argument('--iterations', type=int, default=30)
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument(
+            '--baseline', default=str(BASELINE_FILE),
+            help='JSON с базовой линией'
+        )
+        parser.add_argument(
+            '--threshold', type=float, default=0.25,
+            help='Допустимый рост p50 и памяти относительно базовой линии'
+        )
+        parser.add_argument(
+            '--update-baseline', action='store_true',
+            help='Записать результаты в базовую линию вместо сравнения'
+        )
+        parser.add_argument(
+            '--output', help='Куда дополнительно сохранить результаты JSON'
+        )
+
+    def measure(self, clients, scenario, iterations, warmup):
+        """
+        Сборщик мусора отключается на время каждого замера, как в timeit,
+        чтобы паузы GC не попадали в хвост распределения. Память
+        замеряется отдельными прогонами, потому что tracemalloc сильно
+        замедляет код. Берётся минимальный пик из MEMORY_RUNS: тестовый
+        клиент Django на каждом запросе добавляет запись в реестр
+        weakref.finalize, и изредка пик занимает расширение этого реестра.
+        Время SQL меряется обёрткой execute_wrapper через perf_counter:
+        время в captured_queries округлено до миллисекунды.
+        """
+
+        for _ in range(warmup):
+            run_scenario(clients, scenario)
+        latencies = []
+        queries = []
+        sql_times = []
+        for _ in range(iterations):
+            gc.collect()
+            gc.disable()
+            counter = QueryCounter()
+            try:
+                with connection.execute_wrapper(counter):
+                    started = time.perf_counter()
+                    response, size = run_scenario(clients, scenario)
+                    latencies.append((time.perf_counter() - started) * 1000)
+            finally:
+                gc.enable()
+            if response.status_code >= 400:
+                raise CommandError(
+                    f'{scenario.name}: HTTP {response.status_code}'
+                )
+            queries.append(counter.queries)
+            sql_times.append(counter.duration * 1000)
+        peaks = []
+        for _ in range(MEMORY_RUNS):
+            tracemalloc.start()
+            try:
+                run_scenario(clients, scenario)
+                peaks.append(tracemalloc.get_traced_memory()[1])
+            finally:
+                tracemalloc.stop()
+        peak = min(peaks)
+        return {
+            'p50_ms': round(percentile(latencies, 50), 3),
+            'p95_ms': round(percentile(latencies, 95), 3),
+            'p99_ms': round(percentile(latencies, 99), 3),
+            'queries': max(queries),
+            'sql_ms': round(statistics.median(sql_times), 3),
+            'peak_kb': round(peak / 1024, 1),
+            'response_bytes': size,
+        }
+
+    def run_size(self, size, options):
+        call_command('flush', interactive=False, verbosity=0)
+        call_command(
+            'seed_scale',
+            recipes=size,
+            users=max(size // options['recipes_per_user'], 2),
+            seed=options['seed'],
+            verbosity=0,
+            stdout=io.StringIO(),
+        )
+        user = get_scenario_user()
+        clients = make_clients(user)
+        scenarios = get_scenarios() + get_write_scenarios(clients)
+        results = {}
+        for scenario in scenarios:
+            results[scenario.name] = self.measure(
+                clients, scenario, options['iterations'], options['warmup']
+            )
+            metrics = results[scenario.name]
+            self.stdout.write(
+                f'{size:>8} {scenario.name:<24} '
+                f'p50={metrics["p50_ms"]:8.2f}мс '
+                f'p95={metrics["p95_ms"]:8.2f}мс '
+                f'p99={metrics["p99_ms"]:8.2f}мс '
+                f'SQL={metrics["queries"]:3}/{metrics["sql_ms"]:7.2f}мс '
+                f'память={metrics["peak_kb"]:9.1f}КБ'
+            )
+        return results
+
+    def compare(self, results, baseline, threshold):
+        """
+        Число запросов не должно расти совсем. Медиана задержки и пик
+        памяти могут вырасти не больше чем на threshold. p95 и p99
+        только выводятся, на ноутбуке они слишком шумные для проверки.
+        """
+
+        regressions = []
+        for size, scenarios in results.items():
+            for name, metrics in scenarios.items():
+                expected = baseline.get(size, {}).get(name)
+                if expected is None:
+                    self.stdout.write(self.style.WARNING(
+                        f'{size}/{name}: нет в базовой линии'
+                    ))
+                    continue
+                if metrics['queries'] > expected['queries']:
+                    regressions.append(
+                        f'{size}/{name}: запросов {metrics["queries"]} '
+                        f'вместо {expected["queries"]}'
+                    )
+                p50_limit = max(
+                    expected['p50_ms'] * (1 + threshold),
+                    expected['p50_ms'] + LATENCY_SLACK_MS,
+                )
+                if metrics['p50_ms'] > p50_limit:
+                    regressions.append(
+                        f'{size}/{name}: p50 {metrics["p50_ms"]}мс, '
+                        f'допустимо {p50_limit:.2f}мс'
+                    )
+                memory_limit = max(
+                    expected['peak_kb'] * (1 + threshold),
+                    expected['peak_kb'] + MEMORY_SLACK_KB,
+                )
+                if metrics['peak_kb'] > memory_limit:
+                    regressions.append(
+                        f'{size}/{name}: память {metrics["peak_kb"]}КБ, '
+                        f'допустимо {memory_limit:.1f}КБ'
+                    )
+        return regressions
+
+    def handle(self, *args, **options):
+        vendor = connection.vendor
+        old_name = connection.settings_dict['NAME']
+        results = {}
+        # Кеш ответов анонимам выключен, иначе повторные запросы
+        # замеряли бы только чтение из кеша, а не запросы и сериализацию.
+        with tempfile.TemporaryDirectory() as media_root, override_settings(
+            MEDIA_ROOT=media_root, CACHES=BENCHMARK_CACHES,
+            RESPONSE_CACHE_ENABLED=False,
+        ):
+            connection.creation.create_test_db(
+                verbosity=0, autoclobber=True, serialize=False
+            )
+            try:
+                for size in options['sizes']:
+                    results[str(size)] = self.run_size(size, options)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump({vendor: results}, file, indent=2)
+        try:
+            with open(options['baseline'], encoding='utf-8') as file:
+                baseline = json.load(file)
+        except FileNotFoundError:
+            baseline = {}
+        if options['update_baseline']:
+            baseline[vendor] = results
+            with open(options['baseline'], 'w', encoding='utf-8') as file:
+                json.dump(baseline, file, indent=2, sort_keys=True)
+                file.write('\n')
+            self.stdout.write(self.style.SUCCESS('Базовая линия обновлена!'))
+            return
+        if vendor not in baseline:
+            raise CommandError(
+                f'В {options["baseline"]} нет базовой линии для {vendor}, '
+                'запишите её через --update-baseline.'
+            )
+        regressions = self.compare(
+            results, baseline[vendor], options['threshold']
+        )
+        for regression in regressions:
+            self.stdout.write(self.style.ERROR(regression))
+        if regressions:
+            raise CommandError(f'Регрессий: {len(regressions)}')
+        self.stdout.write(self.style.SUCCESS('Регрессий нет!'))
@@ -0,0 +1,149 @@
+import json
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from ._scenarios import (get_scenario_user, get_scenarios, make_clients,
+                         run_scenario)
+
+TABLE_ALIAS_RE = re.compile(
+    r'(?:FROM|JOIN)\s+"(\w+)"(?:\s+(?:AS\s+)?"?(\w+)"?)?', re.IGNORECASE
+)
+SQLITE_SCAN_RE = re.compile(r'^SCAN (\w+)(?: USING (?:COVERING )?INDEX)?')
+
+
+class Command(BaseCommand):
+    help = (
+        'Прогоняет списочные эндпоинты API на данных из базы, выполняет '
+        'EXPLAIN для каждого SELECT и падает, если план содержит '
+        'последовательное сканирование большой таблицы. COUNT(*) '
+        'пагинации выводится как предупреждение. Рассчитана на '
+        'PostgreSQL, на SQLite разбор плана приблизительный'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-rows', type=int, default=10000,
+            help='С какого числа строк таблица считается большой'
+        )
+        parser.add_argument(
+            '--user', type=int,
+            help='id пользователя для авторизованных сценариев'
+        )
+
+    def get_large_tables(self, min_rows):
+        tables = connection.introspection.table_names()
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute(
+                    'SELECT relname, reltuples FROM pg_class '
+                    'WHERE relkind = %s AND relname = ANY(%s)',
+                    ['r', tables],
+                )
+                rows = cursor.fetchall()
+            else:
+                rows = []
+                for table in tables:
+                    cursor.execute(
+                        f'SELECT COUNT(*) FROM '
+                        f'{connection.ops.quote_name(table)}'
+                    )
+                    rows.append((table, cursor.fetchone()[0]))
+        return {table for table, count in rows if count >= min_rows}
+
+    def find_seq_scans(self, sql):
+        """
+        Возвращает таблицы, которые план запроса читает целиком.
+        Сканирование без фильтра и сортировки прямо под LIMIT не
+        считается: оно останавливается после нужного числа строк.
+        """
+
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}')
+                plan = cursor.fetchone()[0]
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                nodes = [(plan[0]['Plan'], True)]
+                tables = set()
+                while nodes:
+                    node, under_limit = nodes.pop()
+                    if (
+                        node['Node Type'] == 'Seq Scan'
+                        and not (under_limit and 'Filter' not in node)
+                    ):
+                        tables.add(node['Relation Name'])
+                    for child in node.get('Plans', []):
+                        nodes.append((
+                            child,
+                            under_limit and node['Node Type'] == 'Limit',
+                        ))
+                return tables
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            details = [row[-1] for row in cursor.fetchall()]
+        early_exit = (
+            ' LIMIT ' in sql and ' WHERE ' not in sql
+            and not any('TEMP B-TREE' in detail for detail in details)
+        )
+        aliases = {}
+        for table, alias in TABLE_ALIAS_RE.findall(sql):
+            aliases[table] = table
+            if alias:
+                aliases[alias] = table
+        tables = set()
+        for detail in details:
+            match = SQLITE_SCAN_RE.match(detail)
+            if match and 'INDEX' not in detail and not early_exit:
+                tables.add(aliases.get(match.group(1), match.group(1)))
+        return tables
+
+    # Иначе повторный анонимный запрос отдаётся из кеша ответов без SQL.
+    @override_settings(RESPONSE_CACHE_ENABLED=False)
+    def handle(self, *args, **options):
+        user = get_scenario_user(options['user'])
+        if user is None:
+            raise CommandError(
+                'В базе нет пользователей, сначала заполните её данными.'
+            )
+        large_tables = self.get_large_tables(options['min_rows'])
+        self.stdout.write(
+            'Большие таблицы: ' + (', '.join(sorted(large_tables)) or 'нет')
+        )
+        clients = make_clients(user)
+        failures = 0
+        for scenario in get_scenarios():
+            run_scenario(clients, scenario)
+            with CaptureQueriesContext(connection) as queries:
+                response, _ = run_scenario(clients, scenario)
+            problems = []
+            warnings = []
+            for query in queries.captured_queries:
+                sql = query['sql']
+                if not sql.lstrip().upper().startswith('SELECT'):
+                    continue
+                seq_scans = self.find_seq_scans(sql) & large_tables
+                if not seq_scans:
+                    continue
+                if sql.lstrip().upper().startswith('SELECT COUNT(*)'):
+                    warnings.append((', '.join(sorted(seq_scans)), sql))
+                else:
+                    problems.append((', '.join(sorted(seq_scans)), sql))
+            status = self.style.SUCCESS('OK')
+            if response.status_code >= 400:
+                status = self.style.ERROR(f'HTTP {response.status_code}')
+                failures += 1
+            elif problems:
+                status = self.style.ERROR('SEQ SCAN')
+                failures += 1
+            elif warnings:
+                status = self.style.WARNING('COUNT(*)')
+            self.stdout.write(
+                f'{scenario.name}: {len(queries)} запросов, {status}'
+            )
+            for tables, sql in problems + warnings:
+                self.stdout.write(f'    {tables}: {sql}')
+        if failures:
+            raise CommandError(f'Сценариев с проблемами: {failures}')
+        self.stdout.write(self.style.SUCCESS('Планы запросов в порядке!'))
@@ -1,30 +1,165 @@
+import codecs
 import csv
+import json
+import time
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 
+from recipes.ingredient_index import ingredient_index
 from recipes.models import Ingredient
 
 PATH = 'data/'
+READ_CHUNK_SIZE = 64 * 1024
+JSON_SEPARATORS = ' \t\r\n,['
+
+
+def read_csv(file_path, offset):
+    """
+    Построчно читает CSV и отдаёт (name, measurement_unit, offset),
+    где offset это позиция в байтах сразу после строки.
+    """
+
+    with open(file_path, 'rb') as file:
+        file.seek(offset)
+        for line in file:
+            offset += len(line)
+            text = line.decode('utf-8-sig').strip()
+            if not text:
+                continue
+            name, measurement_unit = next(csv.reader([text]))[:2]
+            yield name, measurement_unit, offset
+
+
+def read_json(file_path, offset):
+    """
+    Потоково читает JSON-массив объектов с полями name и
+    measurement_unit, не загружая файл целиком. Продолжить можно
+    с любой позиции между элементами массива. BOM в начале файла
+    пропускается до подсчёта позиций, чтобы они совпадали с байтами
+    файла.
+    """
+
+    decoder = json.JSONDecoder()
+    utf8_decoder = codecs.getincrementaldecoder('utf-8')()
+    with open(file_path, 'rb') as file:
+        if (
+            offset == 0
+            and file.read(len(codecs.BOM_UTF8)) == codecs.BOM_UTF8
+        ):
+            offset = len(codecs.BOM_UTF8)
+        file.seek(offset)
+        buffer = ''
+        eof = False
+        while True:
+            stripped = buffer.lstrip(JSON_SEPARATORS)
+            offset += len(buffer[:len(buffer) - len(stripped)].encode())
+            buffer = stripped
+            if buffer.startswith(']'):
+                return
+            try:
+                item, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                if eof:
+                    if buffer:
+                        raise CommandError(f'Ошибка JSON на байте {offset}.')
+                    return
+                chunk = file.read(READ_CHUNK_SIZE)
+                eof = not chunk
+                buffer += utf8_decoder.decode(chunk, final=eof)
+                continue
+            offset += len(buffer[:end].encode())
+            buffer = buffer[end:]
+            yield item['name'], item['measurement_unit'], offset
 
 
 class Command(BaseCommand):
-    help = 'Импортирование данных из CSV файла'
+    help = (
+        'Импортирование ингредиентов из CSV или JSON файла пачками. '
+        'Повторный запуск не создаёт дубликатов, а прерванный импорт '
+        'можно продолжить с напечатанной позиции через --offset.'
+    )
 
     def add_arguments(self, parser):
-        parser.add_argument('csv_file', type=str, help='Путь к CSV файлу')
-
-    def handle(self, *args, **options):
-        csv_file_path = options['csv_file']
+        parser.add_argument(
+            'csv_file', type=str, help='Путь к CSV или JSON файлу'
+        )
+        parser.add_argument(
+            '--format', choices=('csv', 'json'),
+            help='Формат файла, по умолчанию определяется по расширению'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Количество строк в одной транзакции'
+        )
+        parser.add_argument(
+            '--offset', type=int, default=0,
+            help='Позиция в байтах, с которой продолжить импорт'
+        )
 
-        with open(csv_file_path, 'r', encoding='utf-8') as file:
-            reader = csv.reader(file)
-            for row in reader:
-                name = row[0]
-                measurement_unit = row[1]
+    def write_batch(self, batch):
+        """
+        Пачка пишется одним bulk_create в своей транзакции. Уже
+        существующие ингредиенты пропускаются, ignore_conflicts
+        защищает от параллельной загрузки тех же строк.
+        """
 
-                Ingredient.objects.create(
-                    name=name,
-                    measurement_unit=measurement_unit,
-                )
+        unique_rows = set(batch)
+        with transaction.atomic():
+            existing = set(
+                Ingredient.objects.filter(
+                    name__in={name for name, _ in unique_rows}
+                ).values_list('name', 'measurement_unit')
+            )
+            new_rows = unique_rows - existing
+            Ingredient.objects.bulk_create(
+                [
+                    Ingredient(name=name, measurement_unit=measurement_unit)
+                    for name, measurement_unit in new_rows
+                ],
+                ignore_conflicts=True,
+            )
+        return len(new_rows)
 
-        self.stdout.write(self.style.SUCCESS('Данные импортированы!'))
+    def handle(self, *args, **options):
+        file_path = options['csv_file']
+        file_format = options['format'] or (
+            'json' if file_path.lower().endswith('.json') else 'csv'
+        )
+        reader = read_json if file_format == 'json' else read_csv
+        batch_size = options['batch_size']
+        offset = read_offset = options['offset']
+        total = inserted = 0
+        started = time.monotonic()
+        batch = []
+        try:
+            for name, measurement_unit, read_offset in reader(
+                file_path, offset
+            ):
+                batch.append((name, measurement_unit))
+                if len(batch) < batch_size:
+                    continue
+                inserted += self.write_batch(batch)
+                total += len(batch)
+                offset = read_offset
+                batch = []
+                if options['verbosity'] > 1:
+                    self.stdout.write(f'{total} строк, offset={offset}')
+            if batch:
+                inserted += self.write_batch(batch)
+                total += len(batch)
+                offset = read_offset
+        except (OSError, UnicodeDecodeError, KeyError, ValueError) as error:
+            raise CommandError(
+                f'Импорт остановлен: {error}. '
+                f'Продолжить можно с --offset {offset}'
+            )
+        finally:
+            if inserted:
+                ingredient_index.invalidate()
+        elapsed = max(time.monotonic() - started, 1e-6)
+        self.stdout.write(self.style.SUCCESS(
+            f'Данные импортированы! Строк: {total}, добавлено: {inserted}, '
+            f'пропущено: {total - inserted}, '
+            f'{total / elapsed:.0f} строк/с, offset={offset}'
+        ))
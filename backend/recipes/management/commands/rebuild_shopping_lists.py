@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.services import (calculate_shopping_lists,
+                              get_stored_shopping_lists,
+                              rebuild_shopping_lists)
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересборка агрегата списков покупок из корзин пользователей '
+        'или проверка его расхождений с агрегатом на лету'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user', type=int, action='append', dest='users',
+            help='id пользователя, можно указать несколько раз'
+        )
+        parser.add_argument(
+            '--verify', action='store_true',
+            help='Только сравнить агрегат с корзинами, ничего не меняя'
+        )
+
+    def handle(self, *args, **options):
+        user_ids = options['users']
+        if not options['verify']:
+            rebuild_shopping_lists(user_ids)
+            self.stdout.write(
+                self.style.SUCCESS('Списки покупок пересобраны!')
+            )
+            return
+        expected = calculate_shopping_lists(user_ids)
+        stored = get_stored_shopping_lists(user_ids)
+        mismatches = [
+            (key, stored.get(key), expected.get(key))
+            for key in expected.keys() | stored.keys()
+            if stored.get(key) != expected.get(key)
+        ]
+        for (user_id, ingredient_id), actual, correct in sorted(mismatches):
+            self.stdout.write(
+                f'user={user_id} ingredient={ingredient_id}: '
+                f'{actual} вместо {correct}'
+            )
+        if mismatches:
+            raise CommandError(f'Расхождений: {len(mismatches)}')
+        self.stdout.write(self.style.SUCCESS('Расхождений нет!'))
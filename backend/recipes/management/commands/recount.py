@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.services import recount_counters
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчёт счётчиков избранного, корзин, рецептов и подписок '
+        'по связанным таблицам'
+    )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            fixed = recount_counters()
+        for counter, rows in fixed.items():
+            self.stdout.write(f'{counter}: исправлено строк {rows}')
+        self.stdout.write(self.style.SUCCESS('Счётчики пересчитаны!'))
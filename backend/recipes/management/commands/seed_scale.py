@@ -0,0 +1,339 @@
+import csv
+import io
+import itertools
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+
+from recipes.ingredient_index import ingredient_index
+from recipes.models import Ingredient, Recipe, RecipesIngredients, Tag
+from recipes.services import rebuild_shopping_lists, recount_counters
+from users.models import Subscription
+
+from .load_csv import read_csv
+
+User = get_user_model()
+
+INGREDIENTS_FILE = settings.BASE_DIR / 'dbdata' / 'ingredients.csv'
+SEED_PASSWORD = 'password'
+SEED_IMAGE = 'recipes/seed.png'
+PUB_DATE_START = datetime(2023, 1, 1, tzinfo=timezone.utc)
+PUB_DATE_RANGE = timedelta(days=365)
+
+
+def batched(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def insert_rows(model, fields, rows, batch_size):
+    """
+    Пишет кортежи значений в таблицу модели пачками: в PostgreSQL через
+    COPY, в остальных базах через executemany. Модели и сигналы не
+    создаются, поэтому счётчики и агрегаты пересчитываются после.
+    Возвращает число записанных строк.
+    """
+
+    quote = connection.ops.quote_name
+    columns = ', '.join(
+        quote(model._meta.get_field(field).column) for field in fields
+    )
+    table = quote(model._meta.db_table)
+    total = 0
+    with connection.cursor() as cursor:
+        for batch in batched(rows, batch_size):
+            if connection.vendor == 'postgresql':
+                buffer = io.StringIO()
+                csv.writer(buffer).writerows(batch)
+                buffer.seek(0)
+                cursor.copy_expert(
+                    f'COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)',
+                    buffer,
+                )
+            else:
+                placeholders = ', '.join(['%s'] * len(fields))
+                cursor.executemany(
+                    f'INSERT INTO {table} ({columns}) '
+                    f'VALUES ({placeholders})',
+                    batch,
+                )
+            total += len(batch)
+    return total
+
+
+def next_id(model):
+    return (model.objects.aggregate(max_id=Max('pk'))['max_id'] or 0) + 1
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет базу синтетическими данными для нагрузочных проверок: '
+        'пользователи, рецепты со степенным распределением по авторам, '
+        'ингредиенты рецептов, теги, избранное, корзины и подписки. '
+        'При одинаковом --seed на пустой базе данные совпадают.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument('--tags', type=int, default=10)
+        parser.add_argument(
+            '--ingredients-per-recipe', type=int, nargs=2, default=(3, 12),
+            metavar=('MIN', 'MAX'),
+            help='Сколько ингредиентов в рецепте, равномерно от MIN до MAX'
+        )
+        parser.add_argument(
+            '--favorites', type=float, default=20,
+            help='Среднее число рецептов в избранном пользователя'
+        )
+        parser.add_argument(
+            '--carts', type=float, default=3,
+            help='Среднее число рецептов в корзине пользователя'
+        )
+        parser.add_argument(
+            '--subscriptions', type=float, default=10,
+            help='Среднее число подписок пользователя'
+        )
+        parser.add_argument(
+            '--alpha', type=float, default=1.2,
+            help='Параметр распределения Парето для популярности авторов '
+                 'и рецептов, чем меньше, тем сильнее перекос'
+        )
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument(
+            '--ingredients-file', default=str(INGREDIENTS_FILE),
+            help='CSV каталога ингредиентов, если таблица ингредиентов пуста'
+        )
+
+    def log(self, message):
+        elapsed = time.monotonic() - self.started
+        self.stdout.write(f'[{elapsed:7.1f}s] {message}')
+
+    def pareto_cum_weights(self, rng, size, alpha):
+        return list(itertools.accumulate(
+            rng.paretovariate(alpha) for _ in range(size)
+        ))
+
+    def ensure_ingredients(self, file_path, batch_size):
+        if not Ingredient.objects.exists():
+            try:
+                rows = {
+                    (name, measurement_unit)
+                    for name, measurement_unit, _ in read_csv(file_path, 0)
+                }
+            except OSError as error:
+                raise CommandError(f'Не удалось прочитать {file_path}: '
+                                   f'{error}')
+            Ingredient.objects.bulk_create(
+                [
+                    Ingredient(name=name, measurement_unit=measurement_unit)
+                    for name, measurement_unit in sorted(rows)
+                ],
+                batch_size=batch_size,
+            )
+        return list(
+            Ingredient.objects.order_by('id').values_list('id', 'name')
+        )
+
+    def ensure_tags(self, count):
+        tags = []
+        for index in range(count):
+            tag, _ = Tag.objects.get_or_create(
+                slug=f'seed-tag-{index}',
+                defaults={
+                    'name': f'Тег {index}',
+                    'color': f'#{(index * 2654435761) % 0xFFFFFF:06X}',
+                },
+            )
+            tags.append(tag.pk)
+        return tags
+
+    def handle(self, *args, **options):
+        self.started = time.monotonic()
+        rng = random.Random(options['seed'])
+        batch_size = options['batch_size']
+        users_count = options['users']
+        recipes_count = options['recipes']
+        min_ingredients, max_ingredients = options['ingredients_per_recipe']
+        if users_count < 2 or recipes_count < 1:
+            raise CommandError('Нужно хотя бы 2 пользователя и 1 рецепт.')
+
+        ingredients = self.ensure_ingredients(
+            options['ingredients_file'], batch_size
+        )
+        if len(ingredients) < max_ingredients:
+            raise CommandError('Ингредиентов меньше, чем нужно в рецепте.')
+        tag_ids = self.ensure_tags(options['tags'])
+        ingredient_ids = [pk for pk, _ in ingredients]
+        ingredient_names = [name for _, name in ingredients]
+        first_user_id = next_id(User)
+        first_recipe_id = next_id(Recipe)
+        user_ids = range(first_user_id, first_user_id + users_count)
+        recipe_ids = range(first_recipe_id, first_recipe_id + recipes_count)
+        adapt_datetime = connection.ops.adapt_datetimefield_value
+        joined = adapt_datetime(PUB_DATE_START)
+
+        with transaction.atomic():
+            written = insert_rows(
+                User,
+                [
+                    'id', 'password', 'is_superuser', 'is_staff',
+                    'is_active', 'date_joined', 'username', 'email',
+                    'first_name', 'last_name', 'role', 'recipes_count',
+                    'subscribers_count', 'subscriptions_count',
+                ],
+                (
+                    (
+                        user_id, SEED_PASSWORD, False, False, True, joined,
+                        f'seed_user_{user_id}',
+                        f'seed_user_{user_id}@example.com',
+                        f'Имя{user_id}', f'Фамилия{user_id}', 'user',
+                        0, 0, 0,
+                    )
+                    for user_id in user_ids
+                ),
+                batch_size,
+            )
+            self.log(f'Пользователей: {written}')
+
+            author_weights = self.pareto_cum_weights(
+                rng, users_count, options['alpha']
+            )
+            authors = rng.choices(
+                user_ids, cum_weights=author_weights, k=recipes_count
+            )
+            range_seconds = int(PUB_DATE_RANGE.total_seconds())
+
+            def recipe_rows():
+                for recipe_id, author_id in zip(recipe_ids, authors):
+                    first, second = rng.sample(ingredient_names, 2)
+                    pub_date = PUB_DATE_START + timedelta(
+                        seconds=rng.randrange(range_seconds)
+                    )
+                    yield (
+                        recipe_id, author_id,
+                        f'{first.capitalize()} и {second}'[:200],
+                        SEED_IMAGE,
+                        f'Рецепт {recipe_id}: {first}, {second}.',
+                        rng.randint(5, 180), adapt_datetime(pub_date),
+                        0, 0,
+                    )
+
+            written = insert_rows(
+                Recipe,
+                [
+                    'id', 'author', 'name', 'image', 'text',
+                    'cooking_time', 'pub_date', 'favorites_count',
+                    'in_carts_count',
+                ],
+                recipe_rows(),
+                batch_size,
+            )
+            self.log(f'Рецептов: {written}')
+
+            def recipe_ingredient_rows():
+                for recipe_id in recipe_ids:
+                    count = rng.randint(min_ingredients, max_ingredients)
+                    for ingredient_id in rng.sample(ingredient_ids, count):
+                        yield recipe_id, ingredient_id, rng.randint(1, 500)
+
+            written = insert_rows(
+                RecipesIngredients, ['recipe', 'ingredient', 'amount'],
+                recipe_ingredient_rows(), batch_size,
+            )
+            self.log(f'Ингредиентов в рецептах: {written}')
+
+            def recipe_tag_rows():
+                for recipe_id in recipe_ids:
+                    count = rng.randint(1, min(3, len(tag_ids)))
+                    for tag_id in rng.sample(tag_ids, count):
+                        yield recipe_id, tag_id
+
+            if tag_ids:
+                written = insert_rows(
+                    Recipe.tags.through, ['recipe', 'tag'],
+                    recipe_tag_rows(), batch_size,
+                )
+                self.log(f'Тегов у рецептов: {written}')
+
+            recipe_weights = self.pareto_cum_weights(
+                rng, recipes_count, options['alpha']
+            )
+
+            def user_links(average, targets, cum_weights, exclude_self):
+                """
+                Для каждого пользователя выбирает в среднем average целей
+                с учётом популярности, без повторов.
+                """
+
+                limit = len(targets) - 1
+                for user_id in user_ids:
+                    count = min(
+                        int(rng.expovariate(1 / average)) if average else 0,
+                        limit,
+                    )
+                    chosen = set(rng.choices(
+                        targets, cum_weights=cum_weights, k=count
+                    ))
+                    if exclude_self:
+                        chosen.discard(user_id)
+                    for target_id in sorted(chosen):
+                        yield user_id, target_id
+
+            written = insert_rows(
+                Recipe.favorites.through, ['user', 'recipe'],
+                user_links(
+                    options['favorites'], recipe_ids, recipe_weights, False
+                ),
+                batch_size,
+            )
+            self.log(f'Избранного: {written}')
+            written = insert_rows(
+                Recipe.groceries_list.through, ['user', 'recipe'],
+                user_links(
+                    options['carts'], recipe_ids, recipe_weights, False
+                ),
+                batch_size,
+            )
+            self.log(f'Рецептов в корзинах: {written}')
+            written = insert_rows(
+                Subscription, ['user', 'subscription'],
+                user_links(
+                    options['subscriptions'], user_ids, author_weights, True
+                ),
+                batch_size,
+            )
+            self.log(f'Подписок: {written}')
+
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(
+                    no_style(), [User, Recipe]
+                ):
+                    cursor.execute(sql)
+            recount_counters()
+            self.log('Счётчики пересчитаны')
+            rebuild_shopping_lists(batch_size=batch_size)
+            self.log('Списки покупок пересобраны')
+
+        call_command(
+            'update_search_vectors', batch_size=batch_size, stdout=self.stdout
+        )
+        ingredient_index.invalidate()
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+        self.log('Поисковые векторы обновлены, статистика собрана')
+        self.stdout.write(self.style.SUCCESS('База заполнена!'))
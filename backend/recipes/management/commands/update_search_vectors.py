@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from recipes.models import Recipe
+from recipes.search import update_search_vectors
+
+
+class Command(BaseCommand):
+    help = 'Пересчёт поисковых векторов рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Количество рецептов в одном UPDATE'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        recipe_ids = Recipe.objects.order_by('id').values_list(
+            'id', flat=True
+        )
+        batch = []
+        for recipe_id in recipe_ids.iterator(chunk_size=batch_size):
+            batch.append(recipe_id)
+            if len(batch) == batch_size:
+                update_search_vectors(batch)
+                batch = []
+        update_search_vectors(batch)
+        self.stdout.write(self.style.SUCCESS('Поисковые векторы обновлены!'))
@@ -0,0 +1,37 @@
+# Generated by Django 3.2.16 on 2026-10-18 18:00
+
+import colorfield.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_auto_20240102_2017'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='recipe',
+            options={'ordering': ('-pub_date', '-id'), 'verbose_name': 'рецепт', 'verbose_name_plural': 'Рецепты'},
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(default=None, upload_to='recipes/', verbose_name='Картинка'),
+        ),
+        migrations.AlterField(
+            model_name='tag',
+            name='color',
+            field=colorfield.fields.ColorField(default='#FF0000', image_field=None, max_length=16, samples=None, unique=True, verbose_name='Цвет'),
+        ),
+        migrations.AlterField(
+            model_name='tag',
+            name='name',
+            field=models.CharField(max_length=256, unique=True, verbose_name='Название тега'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-pub_date', '-id'], name='recipe_pub_date_id_idx'),
+        ),
+    ]
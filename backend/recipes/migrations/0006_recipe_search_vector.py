@@ -0,0 +1,61 @@
+# Generated by Django 3.2.16 on 2026-10-18 18:01
+
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+SEARCH_CONFIG = 'russian'
+
+
+def create_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'CREATE INDEX recipe_search_vector_idx ON recipes_recipe '
+        'USING gin (search_vector)'
+    )
+    schema_editor.execute(
+        'CREATE INDEX recipe_name_trgm_idx ON recipes_recipe '
+        'USING gin (name gin_trgm_ops)'
+    )
+    schema_editor.execute(
+        """
+        UPDATE recipes_recipe SET search_vector =
+            setweight(to_tsvector(%(config)s::regconfig,
+                                  coalesce(recipes_recipe.name, '')), 'A')
+            || setweight(to_tsvector(%(config)s::regconfig, coalesce((
+                SELECT string_agg(ingredient.name, ' ')
+                FROM recipes_recipesingredients recipe_ingredient
+                JOIN recipes_ingredient ingredient
+                    ON ingredient.id = recipe_ingredient.ingredient_id
+                WHERE recipe_ingredient.recipe_id = recipes_recipe.id
+            ), '')), 'B')
+            || setweight(to_tsvector(%(config)s::regconfig,
+                                     coalesce(recipes_recipe.text, '')), 'C')
+        """,
+        {'config': SEARCH_CONFIG},
+    )
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS recipe_search_vector_idx')
+    schema_editor.execute('DROP INDEX IF EXISTS recipe_name_trgm_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_recipe_pub_date_id_idx'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Поисковый вектор'),
+        ),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 3.2.16 on 2026-10-18 18:12
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_related(related_model, related_field):
+    return Coalesce(
+        Subquery(
+            related_model.objects.filter(
+                **{related_field: OuterRef('pk')}
+            ).order_by().values(related_field).annotate(
+                total=Count('pk')
+            ).values('total')
+        ),
+        0,
+    )
+
+
+def fill_counters(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    User = apps.get_model('users', 'User')
+    Subscription = apps.get_model('users', 'Subscription')
+    favorites = Recipe._meta.get_field('favorites').remote_field.through
+    groceries_list = Recipe._meta.get_field(
+        'groceries_list'
+    ).remote_field.through
+    Recipe.objects.update(
+        favorites_count=count_related(favorites, 'recipe'),
+        in_carts_count=count_related(groceries_list, 'recipe'),
+    )
+    User.objects.update(
+        recipes_count=count_related(Recipe, 'author'),
+        subscribers_count=count_related(Subscription, 'subscription'),
+        subscriptions_count=count_related(Subscription, 'user'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_shoppinglistingredient'),
+        ('users', '0003_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Добавлено в избранное количество раз'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='in_carts_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Добавлено в список покупок количество раз'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
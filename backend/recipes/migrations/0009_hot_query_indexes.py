@@ -0,0 +1,62 @@
+# Generated by Django 3.2.16 on 2026-10-18 18:13
+
+from django.db import migrations, models
+
+THROUGH_INDEXES = (
+    ('recipe_favorites_user_recipe_idx', 'recipes_recipe_favorites',
+     'user_id, recipe_id'),
+    ('recipe_carts_user_recipe_idx', 'recipes_recipe_groceries_list',
+     'user_id, recipe_id'),
+    ('recipe_tags_tag_recipe_idx', 'recipes_recipe_tags',
+     'tag_id, recipe_id'),
+)
+
+
+def create_ingredient_name_index(apps, schema_editor):
+    """
+    istartswith в PostgreSQL компилируется в UPPER("name"::text) LIKE
+    UPPER(%s), поэтому индекс строится по тому же выражению.
+    text_pattern_ops нужен, чтобы LIKE по префиксу использовал индекс
+    при любой локали базы данных.
+    """
+
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'CREATE INDEX ingredient_name_upper_pattern_idx '
+        'ON recipes_ingredient (UPPER(name::text) text_pattern_ops)'
+    )
+
+
+def drop_ingredient_name_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'DROP INDEX IF EXISTS ingredient_name_upper_pattern_idx'
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_recipe_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['author', '-pub_date', '-id'], name='recipe_author_pub_date_idx'),
+        ),
+        migrations.RunSQL(
+            sql=[
+                f'CREATE INDEX {name} ON {table} ({columns})'
+                for name, table, columns in THROUGH_INDEXES
+            ],
+            reverse_sql=[
+                f'DROP INDEX {name}' for name, _, _ in THROUGH_INDEXES
+            ],
+        ),
+        migrations.RunPython(
+            create_ingredient_name_index, drop_ingredient_name_index
+        ),
+    ]
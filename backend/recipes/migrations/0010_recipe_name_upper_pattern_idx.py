@@ -0,0 +1,36 @@
+# Generated by Django 3.2.16 on 2026-10-18 21:40
+
+from django.db import migrations
+
+
+def create_recipe_name_index(apps, schema_editor):
+    """
+    Поиск в админке по '^name' это istartswith, индекс строится по тому
+    же выражению, что и ingredient_name_upper_pattern_idx.
+    """
+
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'CREATE INDEX recipe_name_upper_pattern_idx '
+        'ON recipes_recipe (UPPER(name::text) text_pattern_ops)'
+    )
+
+
+def drop_recipe_name_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS recipe_name_upper_pattern_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            create_recipe_name_index, drop_recipe_name_index
+        ),
+    ]
@@ -1,5 +1,6 @@
 from colorfield.fields import ColorField
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator
 from django.db import models
 
@@ -83,9 +84,29 @@ class Recipe(models.Model):
         blank=True,
         verbose_name="Список покупок",
     )
+    favorites_count = models.PositiveIntegerField(
+        default=0, editable=False,
+        verbose_name="Добавлено в избранное количество раз"
+    )
+    in_carts_count = models.PositiveIntegerField(
+        default=0, editable=False,
+        verbose_name="Добавлено в список покупок количество раз"
+    )
+    search_vector = SearchVectorField(
+        null=True, editable=False, verbose_name="Поисковый вектор"
+    )
 
     class Meta:
-        ordering = ('-pub_date',)
+        ordering = ('-pub_date', '-id')
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'], name='recipe_pub_date_id_idx'
+            ),
+            models.Index(
+                fields=['author', '-pub_date', '-id'],
+                name='recipe_author_pub_date_idx',
+            ),
+        ]
         verbose_name = 'рецепт'
         verbose_name_plural = 'Рецепты'
 
@@ -111,3 +132,34 @@ class RecipesIngredients(models.Model):
                 name='recipeingredient_unique')]
         verbose_name = 'рецепт и ингредиент'
         verbose_name_plural = 'Рецепты и ингредиенты'
+
+
+class ShoppingListIngredient(models.Model):
+    """
+    Агрегат списка покупок: сколько ингредиента нужно пользователю
+    по всем рецептам из его корзины и из скольких рецептов он набран.
+    Обновляется дельтами при изменении корзины и ингредиентов рецептов.
+    """
+
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE,
+        related_name='shopping_list', verbose_name="Пользователь"
+    )
+    ingredient = models.ForeignKey(
+        Ingredient, on_delete=models.CASCADE,
+        related_name='shopping_lists', verbose_name="Ингредиент"
+    )
+    total_amount = models.IntegerField(
+        default=0, verbose_name='Общее количество'
+    )
+    recipe_count = models.IntegerField(
+        default=0, verbose_name='Количество рецептов'
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='shoppinglist_unique')]
+        verbose_name = 'ингредиент списка покупок'
+        verbose_name_plural = 'Списки покупок'
@@ -0,0 +1,72 @@
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            TrigramSimilarity)
+from django.db import connection, connections
+from django.db.models import Exists, F, OuterRef, Q
+
+from .models import RecipesIngredients
+
+SEARCH_CONFIG = 'russian'
+
+UPDATE_SEARCH_VECTOR_SQL = """
+    UPDATE recipes_recipe SET search_vector =
+        setweight(to_tsvector(%(config)s::regconfig,
+                              coalesce(recipes_recipe.name, '')), 'A')
+        || setweight(to_tsvector(%(config)s::regconfig, coalesce((
+            SELECT string_agg(ingredient.name, ' ')
+            FROM recipes_recipesingredients recipe_ingredient
+            JOIN recipes_ingredient ingredient
+                ON ingredient.id = recipe_ingredient.ingredient_id
+            WHERE recipe_ingredient.recipe_id = recipes_recipe.id
+        ), '')), 'B')
+        || setweight(to_tsvector(%(config)s::regconfig,
+                                 coalesce(recipes_recipe.text, '')), 'C')
+    WHERE recipes_recipe.id = ANY(%(ids)s)
+"""
+
+
+def update_search_vectors(recipe_ids):
+    """
+    Пересчитывает поисковый вектор рецептов: название весит больше
+    ингредиентов, ингредиенты больше описания. Вектор есть только
+    в PostgreSQL, на других базах функция ничего не делает.
+    """
+
+    if connection.vendor != 'postgresql' or not recipe_ids:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            UPDATE_SEARCH_VECTOR_SQL,
+            {'config': SEARCH_CONFIG, 'ids': list(recipe_ids)},
+        )
+
+
+def search_recipes(queryset, query):
+    """
+    Полнотекстовый поиск рецептов с ранжированием. В PostgreSQL
+    используется search_vector по GIN индексу, а опечатки в названии
+    добираются триграммным сходством (оператор %, GIN индекс
+    gin_trgm_ops). На других базах, например SQLite в локальной
+    разработке, поиск деградирует до icontains по названию, описанию
+    и ингредиентам без ранжирования.
+    """
+
+    if connections[queryset.db].vendor != 'postgresql':
+        ingredients = RecipesIngredients.objects.filter(
+            recipe=OuterRef('pk'), ingredient__name__icontains=query
+        )
+        return queryset.filter(
+            Q(name__icontains=query)
+            | Q(text__icontains=query)
+            | Exists(ingredients)
+        )
+    search_query = SearchQuery(
+        query, config=SEARCH_CONFIG, search_type='websearch'
+    )
+    return queryset.filter(
+        Q(search_vector=search_query) | Q(name__trigram_similar=query)
+    ).annotate(
+        search_rank=SearchRank(F('search_vector'), search_query),
+        similarity=TrigramSimilarity('name', query),
+    ).order_by(
+        '-search_rank', '-similarity', *queryset.model._meta.ordering
+    )
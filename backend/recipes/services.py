@@ -0,0 +1,492 @@
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.db.models import (Case, Count, F, IntegerField, OuterRef, Subquery,
+                              Sum, Value, When)
+from django.db.models.functions import Coalesce
+
+from users.models import Subscription
+
+from .models import Recipe, RecipesIngredients, ShoppingListIngredient
+
+User = get_user_model()
+
+
+def get_recipes_totals(recipe_ids):
+    """
+    Количество каждого ингредиента по рецептам и число рецептов,
+    в которых он встречается: {ingredient_id: (amount, recipe_count)}.
+    """
+
+    rows = RecipesIngredients.objects.filter(
+        recipe_id__in=recipe_ids
+    ).values('ingredient_id').annotate(
+        amount=Sum('amount'), recipes=Count('recipe_id')
+    ).order_by()
+    return {
+        row['ingredient_id']: (row['amount'], row['recipes'])
+        for row in rows
+    }
+
+
+def lock_recipes(recipe_ids):
+    """
+    Блокирует строки рецептов до конца транзакции. Изменение корзины
+    и изменение ингредиентов рецепта берут эту блокировку до чтения
+    количеств и пользователей корзины, поэтому идут по очереди, и дельта
+    каждого из них видна другому. Отдельным запросом, чтобы следующие
+    запросы читали данные, закоммиченные за время ожидания. Базы без
+    SELECT FOR UPDATE, как SQLite, и так выполняют записи по очереди.
+    """
+
+    if not connection.features.has_select_for_update:
+        return
+    list(
+        Recipe.objects.select_for_update().filter(
+            pk__in=recipe_ids
+        ).order_by('pk').values_list('pk', flat=True)
+    )
+
+
+def apply_shopping_list_deltas(user_ids, deltas):
+    """
+    Применяет дельты {ingredient_id: (amount, recipe_count)} к спискам
+    покупок пользователей: одна UPDATE для существующих строк,
+    bulk_create для новых и удаление строк, где рецептов не осталось.
+    Строки пользователей блокируются, чтобы параллельные изменения
+    корзины одного пользователя шли по очереди.
+    """
+
+    deltas = {
+        ingredient_id: delta for ingredient_id, delta in deltas.items()
+        if delta != (0, 0)
+    }
+    if not user_ids or not deltas:
+        return
+    with transaction.atomic():
+        list(
+            User.objects.select_for_update().filter(
+                pk__in=user_ids
+            ).order_by('pk').values_list('pk', flat=True)
+        )
+        rows = ShoppingListIngredient.objects.filter(
+            user_id__in=user_ids, ingredient_id__in=deltas
+        )
+        existing = set(rows.values_list('user_id', 'ingredient_id'))
+        rows.update(
+            total_amount=F('total_amount') + Case(
+                *[
+                    When(ingredient_id=ingredient_id, then=Value(amount))
+                    for ingredient_id, (amount, _) in deltas.items()
+                ],
+                default=Value(0), output_field=IntegerField(),
+            ),
+            recipe_count=F('recipe_count') + Case(
+                *[
+                    When(ingredient_id=ingredient_id, then=Value(count))
+                    for ingredient_id, (_, count) in deltas.items()
+                ],
+                default=Value(0), output_field=IntegerField(),
+            ),
+        )
+        ShoppingListIngredient.objects.bulk_create([
+            ShoppingListIngredient(
+                user_id=user_id,
+                ingredient_id=ingredient_id,
+                total_amount=amount,
+                recipe_count=count,
+            )
+            for user_id in user_ids
+            for ingredient_id, (amount, count) in deltas.items()
+            if count > 0 and (user_id, ingredient_id) not in existing
+        ])
+        ShoppingListIngredient.objects.filter(
+            user_id__in=user_ids, recipe_count__lte=0
+        ).delete()
+
+
+def add_to_shopping_list(user_id, recipe_ids):
+    apply_shopping_list_deltas([user_id], get_recipes_totals(recipe_ids))
+
+
+def remove_from_shopping_list(user_id, recipe_ids):
+    apply_shopping_list_deltas([user_id], {
+        ingredient_id: (-amount, -count)
+        for ingredient_id, (amount, count)
+        in get_recipes_totals(recipe_ids).items()
+    })
+
+
+COUNTERS = (
+    (Recipe, 'favorites_count', Recipe.favorites.through, 'recipe'),
+    (Recipe, 'in_carts_count', Recipe.groceries_list.through, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'subscribers_count', Subscription, 'subscription'),
+    (User, 'subscriptions_count', Subscription, 'user'),
+)
+
+
+def change_counter(model, pks, field, delta):
+    """
+    Атомарно меняет счётчик field у объектов pks на delta одной UPDATE.
+    """
+
+    if pks and delta:
+        model.objects.filter(pk__in=pks).update(**{field: F(field) + delta})
+
+
+def recount_counters():
+    """
+    Пересчитывает все счётчики по связанным таблицам и исправляет только
+    разошедшиеся строки. Возвращает число исправленных строк по каждому
+    счётчику.
+    """
+
+    fixed = {}
+    for model, field, related_model, related_field in COUNTERS:
+        actual = Coalesce(
+            Subquery(
+                related_model.objects.filter(
+                    **{related_field: OuterRef('pk')}
+                ).order_by().values(related_field).annotate(
+                    total=Count('pk')
+                ).values('total')
+            ),
+            0,
+        )
+        fixed[f'{model.__name__}.{field}'] = model.objects.annotate(
+            actual=actual
+        ).exclude(**{field: F('actual')}).update(**{field: actual})
+    return fixed
+
+
+def link(through, source_field, source_id, target_field, target_id):
+    """
+    Создаёт связь одной командой INSERT ... SELECT ... ON CONFLICT DO
+    NOTHING: строка вставляется, только если цель существует и связи ещё
+    нет, поэтому повторные и параллельные запросы безопасны. Возвращает
+    True, если связь создана, False, если она уже была, и None, если цели
+    не существует (проверяется отдельным запросом только в этом случае).
+    """
+
+    target_model = through._meta.get_field(target_field).related_model
+    quote = connection.ops.quote_name
+    target_pk = quote(target_model._meta.pk.column)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {quote(through._meta.db_table)} '
+            f'({quote(through._meta.get_field(source_field).column)}, '
+            f'{quote(through._meta.get_field(target_field).column)}) '
+            f'SELECT %s, {target_pk} '
+            f'FROM {quote(target_model._meta.db_table)} '
+            f'WHERE {target_pk} = %s '
+            'ON CONFLICT DO NOTHING',
+            [source_id, target_id],
+        )
+        created = cursor.rowcount > 0
+    if created:
+        return True
+    if target_model.objects.filter(pk=target_id).exists():
+        return False
+    return None
+
+
+def unlink(through, source_field, source_id, target_field, target_id):
+    """
+    Удаляет связь одной командой DELETE. Возвращает True, если связь
+    удалена, False, если её не было, и None, если цели не существует.
+    """
+
+    target_model = through._meta.get_field(target_field).related_model
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {quote(through._meta.db_table)} '
+            f'WHERE {quote(through._meta.get_field(source_field).column)} '
+            f'= %s AND '
+            f'{quote(through._meta.get_field(target_field).column)} = %s',
+            [source_id, target_id],
+        )
+        deleted = cursor.rowcount > 0
+    if deleted:
+        return True
+    if target_model.objects.filter(pk=target_id).exists():
+        return False
+    return None
+
+
+def add_favorite(user_id, recipe_id):
+    with transaction.atomic():
+        created = link(
+            Recipe.favorites.through, 'user', user_id, 'recipe', recipe_id
+        )
+        if created:
+            change_counter(Recipe, [recipe_id], 'favorites_count', 1)
+    return created
+
+
+def remove_favorite(user_id, recipe_id):
+    with transaction.atomic():
+        deleted = unlink(
+            Recipe.favorites.through, 'user', user_id, 'recipe', recipe_id
+        )
+        if deleted:
+            change_counter(Recipe, [recipe_id], 'favorites_count', -1)
+    return deleted
+
+
+def add_to_cart(user_id, recipe_id):
+    """
+    Добавляет рецепт в корзину и, если он добавлен сейчас, переносит
+    его ингредиенты в список покупок в той же транзакции.
+    """
+
+    with transaction.atomic():
+        lock_recipes([recipe_id])
+        created = link(
+            Recipe.groceries_list.through, 'user', user_id,
+            'recipe', recipe_id,
+        )
+        if created:
+            change_counter(Recipe, [recipe_id], 'in_carts_count', 1)
+            add_to_shopping_list(user_id, [recipe_id])
+    return created
+
+
+def remove_from_cart(user_id, recipe_id):
+    with transaction.atomic():
+        lock_recipes([recipe_id])
+        deleted = unlink(
+            Recipe.groceries_list.through, 'user', user_id,
+            'recipe', recipe_id,
+        )
+        if deleted:
+            change_counter(Recipe, [recipe_id], 'in_carts_count', -1)
+            remove_from_shopping_list(user_id, [recipe_id])
+    return deleted
+
+
+def subscribe(user_id, author_id):
+    with transaction.atomic():
+        created = link(
+            Subscription, 'user', user_id, 'subscription', author_id
+        )
+        if created:
+            change_counter(User, [author_id], 'subscribers_count', 1)
+            change_counter(User, [user_id], 'subscriptions_count', 1)
+    return created
+
+
+def unsubscribe(user_id, author_id):
+    with transaction.atomic():
+        deleted = unlink(
+            Subscription, 'user', user_id, 'subscription', author_id
+        )
+        if deleted:
+            change_counter(User, [author_id], 'subscribers_count', -1)
+            change_counter(User, [user_id], 'subscriptions_count', -1)
+    return deleted
+
+
+def link_many(through, source_field, source_id, target_field, target_ids):
+    """
+    Создаёт связи с несколькими целями одной командой INSERT ... SELECT
+    ... ON CONFLICT DO NOTHING RETURNING. Возвращает множества id:
+    созданные связи, уже существовавшие и несуществующие цели.
+    """
+
+    target_model = through._meta.get_field(target_field).related_model
+    target_column = through._meta.get_field(target_field).column
+    quote = connection.ops.quote_name
+    target_pk = quote(target_model._meta.pk.column)
+    placeholders = ', '.join(['%s'] * len(target_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {quote(through._meta.db_table)} '
+            f'({quote(through._meta.get_field(source_field).column)}, '
+            f'{quote(target_column)}) '
+            f'SELECT %s, {target_pk} '
+            f'FROM {quote(target_model._meta.db_table)} '
+            f'WHERE {target_pk} IN ({placeholders}) '
+            f'ON CONFLICT DO NOTHING RETURNING {quote(target_column)}',
+            [source_id, *target_ids],
+        )
+        created = {row[0] for row in cursor.fetchall()}
+    return (created, *split_missing(target_model, set(target_ids) - created))
+
+
+def unlink_many(through, source_field, source_id, target_field,
+                target_ids=None):
+    """
+    Удаляет связи с несколькими целями одной командой DELETE ...
+    RETURNING, без target_ids удаляет все связи источника. Возвращает
+    множества id: удалённые связи, отсутствовавшие и несуществующие цели.
+    """
+
+    target_model = through._meta.get_field(target_field).related_model
+    target_column = through._meta.get_field(target_field).column
+    quote = connection.ops.quote_name
+    sql = (
+        f'DELETE FROM {quote(through._meta.db_table)} '
+        f'WHERE {quote(through._meta.get_field(source_field).column)} = %s'
+    )
+    params = [source_id]
+    if target_ids is not None:
+        placeholders = ', '.join(['%s'] * len(target_ids))
+        sql += f' AND {quote(target_column)} IN ({placeholders})'
+        params.extend(target_ids)
+    with connection.cursor() as cursor:
+        cursor.execute(f'{sql} RETURNING {quote(target_column)}', params)
+        deleted = {row[0] for row in cursor.fetchall()}
+    if target_ids is None:
+        return deleted, set(), set()
+    return (deleted, *split_missing(target_model, set(target_ids) - deleted))
+
+
+def split_missing(model, ids):
+    """
+    Делит id на существующие и несуществующие объекты модели.
+    """
+
+    if not ids:
+        return set(), set()
+    existing = set(
+        model.objects.filter(pk__in=ids).values_list('pk', flat=True)
+    )
+    return existing, ids - existing
+
+
+def add_many_favorites(user_id, recipe_ids):
+    with transaction.atomic():
+        result = link_many(
+            Recipe.favorites.through, 'user', user_id, 'recipe', recipe_ids
+        )
+        change_counter(Recipe, result[0], 'favorites_count', 1)
+    return result
+
+
+def remove_many_favorites(user_id, recipe_ids=None):
+    with transaction.atomic():
+        result = unlink_many(
+            Recipe.favorites.through, 'user', user_id, 'recipe', recipe_ids
+        )
+        change_counter(Recipe, result[0], 'favorites_count', -1)
+    return result
+
+
+def add_many_to_cart(user_id, recipe_ids):
+    with transaction.atomic():
+        lock_recipes(recipe_ids)
+        result = link_many(
+            Recipe.groceries_list.through, 'user', user_id,
+            'recipe', recipe_ids,
+        )
+        if result[0]:
+            change_counter(Recipe, result[0], 'in_carts_count', 1)
+            add_to_shopping_list(user_id, result[0])
+    return result
+
+
+def remove_many_from_cart(user_id, recipe_ids=None):
+    """
+    Удаляет рецепты из корзины. Без recipe_ids корзина и список покупок
+    очищаются целиком, без пересчёта дельт.
+    """
+
+    with transaction.atomic():
+        lock_recipes(
+            Recipe.groceries_list.through.objects.filter(
+                user_id=user_id
+            ).values('recipe_id') if recipe_ids is None else recipe_ids
+        )
+        result = unlink_many(
+            Recipe.groceries_list.through, 'user', user_id,
+            'recipe', recipe_ids,
+        )
+        change_counter(Recipe, result[0], 'in_carts_count', -1)
+        if recipe_ids is None:
+            ShoppingListIngredient.objects.filter(user_id=user_id).delete()
+        elif result[0]:
+            remove_from_shopping_list(user_id, result[0])
+    return result
+
+
+def update_shopping_lists(recipe, ingredient_changes):
+    """
+    Переносит изменение ингредиентов рецепта в списки покупок всех
+    пользователей, у которых он в корзине. Изменения передаются словарём
+    {ingredient_id: (old_amount, new_amount)}, None вместо количества
+    означает, что ингредиента в рецепте не было или больше нет.
+    """
+
+    deltas = {
+        ingredient_id: (
+            (new_amount or 0) - (old_amount or 0),
+            (new_amount is not None) - (old_amount is not None),
+        )
+        for ingredient_id, (old_amount, new_amount)
+        in ingredient_changes.items()
+    }
+    with transaction.atomic():
+        lock_recipes([recipe.pk])
+        user_ids = list(
+            recipe.groceries_list.values_list('pk', flat=True)
+        )
+        apply_shopping_list_deltas(user_ids, deltas)
+
+
+def calculate_shopping_lists(user_ids=None):
+    """
+    Считает списки покупок с нуля агрегатом по корзинам:
+    {(user_id, ingredient_id): (total_amount, recipe_count)}.
+    """
+
+    rows = RecipesIngredients.objects.filter(
+        recipe__groceries_list__isnull=False
+    )
+    if user_ids is not None:
+        rows = rows.filter(recipe__groceries_list__in=user_ids)
+    rows = rows.values(
+        'ingredient_id', user_id=F('recipe__groceries_list')
+    ).annotate(
+        amount=Sum('amount'), recipes=Count('recipe_id')
+    ).order_by()
+    return {
+        (row['user_id'], row['ingredient_id']): (
+            row['amount'], row['recipes']
+        )
+        for row in rows.iterator()
+    }
+
+
+def get_stored_shopping_lists(user_ids=None):
+    rows = ShoppingListIngredient.objects.all()
+    if user_ids is not None:
+        rows = rows.filter(user_id__in=user_ids)
+    return {
+        (user_id, ingredient_id): (total_amount, recipe_count)
+        for user_id, ingredient_id, total_amount, recipe_count
+        in rows.values_list(
+            'user_id', 'ingredient_id', 'total_amount', 'recipe_count'
+        ).iterator()
+    }
+
+
+def rebuild_shopping_lists(user_ids=None, batch_size=5000):
+    with transaction.atomic():
+        rows = ShoppingListIngredient.objects.all()
+        if user_ids is not None:
+            rows = rows.filter(user_id__in=user_ids)
+        rows.delete()
+        ShoppingListIngredient.objects.bulk_create(
+            (
+                ShoppingListIngredient(
+                    user_id=user_id,
+                    ingredient_id=ingredient_id,
+                    total_amount=amount,
+                    recipe_count=count,
+                )
+                for (user_id, ingredient_id), (amount, count)
+                in calculate_shopping_lists(user_ids).items()
+            ),
+            batch_size=batch_size,
+        )
@@ -0,0 +1,163 @@
+from django.contrib.auth import get_user_model
+from django.db.models import F
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.dispatch import Signal, receiver
+
+from .ingredient_index import ingredient_index
+from .models import Ingredient, Recipe
+from .search import update_search_vectors
+from .services import (apply_shopping_list_deltas, change_counter,
+                       get_recipes_totals, lock_recipes, update_shopping_lists)
+
+User = get_user_model()
+
+# Отправляется после создания или изменения рецепта через API или
+# админку внутри той же транзакции. Аргументы: recipe, created,
+# ingredient_changes ({ingredient_id: (old_amount, new_amount)}, None
+# если ингредиента не было или он удалён), tags (текущие объекты Tag),
+# tags_added и tags_removed (множества id).
+recipe_changed = Signal()
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+def invalidate_ingredient_index(sender, **kwargs):
+    ingredient_index.invalidate()
+
+
+@receiver(pre_delete, sender=Recipe)
+def remove_recipe_from_shopping_lists(sender, instance, **kwargs):
+    lock_recipes([instance.pk])
+    user_ids = list(instance.groceries_list.values_list('pk', flat=True))
+    if user_ids:
+        apply_shopping_list_deltas(user_ids, {
+            ingredient_id: (-amount, -count)
+            for ingredient_id, (amount, count)
+            in get_recipes_totals([instance.pk]).items()
+        })
+
+
+@receiver(recipe_changed)
+def apply_recipe_changes_to_shopping_lists(
+    sender, recipe, created, ingredient_changes, **kwargs
+):
+    if not created and ingredient_changes:
+        update_shopping_lists(recipe, ingredient_changes)
+
+
+@receiver(recipe_changed)
+def refresh_recipe_search_vector(sender, recipe, **kwargs):
+    update_search_vectors([recipe.pk])
+
+
+@receiver(post_save, sender=Recipe)
+def increment_author_recipes_count(sender, instance, created, **kwargs):
+    if created:
+        change_counter(User, [instance.author_id], 'recipes_count', 1)
+
+
+@receiver(post_delete, sender=Recipe)
+def decrement_author_recipes_count(sender, instance, **kwargs):
+    change_counter(User, [instance.author_id], 'recipes_count', -1)
+
+
+@receiver(pre_delete, sender=User)
+def decrement_counters_of_related_objects(sender, instance, **kwargs):
+    """
+    Связи удаляемого пользователя удаляются каскадом без сигналов,
+    поэтому счётчики рецептов и других пользователей уменьшаются здесь.
+    """
+
+    Recipe.objects.filter(favorites=instance).update(
+        favorites_count=F('favorites_count') - 1
+    )
+    Recipe.objects.filter(groceries_list=instance).update(
+        in_carts_count=F('in_carts_count') - 1
+    )
+    User.objects.filter(subscribers__user=instance).update(
+        subscribers_count=F('subscribers_count') - 1
+    )
+    User.objects.filter(subscriptions__subscription=instance).update(
+        subscriptions_count=F('subscriptions_count') - 1
+    )
+
+
+def change_relation_counter(field, relation, instance, action, reverse,
+                            pk_set):
+    """
+    Поддерживает счётчики рецептов при изменении избранного и корзины
+    через ORM, например в админке. API меняет эти связи напрямую SQL
+    и обновляет счётчики само. Удаление учитывается до удаления связей,
+    по тем из них, которые действительно есть: в pre_remove pk_set
+    содержит все переданные id, а в post_clear он пуст.
+    """
+
+    if action == 'post_add':
+        sign = 1
+    elif action in ('pre_remove', 'pre_clear'):
+        sign = -1
+        existing = getattr(instance, relation).all()
+        if action == 'pre_remove':
+            existing = existing.filter(pk__in=pk_set)
+        pk_set = set(existing.values_list('pk', flat=True))
+    else:
+        return
+    if not pk_set:
+        return
+    if reverse:
+        change_counter(Recipe, pk_set, field, sign)
+    else:
+        change_counter(Recipe, [instance.pk], field, sign * len(pk_set))
+
+
+@receiver(m2m_changed, sender=Recipe.favorites.through)
+def change_favorites_count(sender, instance, action, reverse, pk_set,
+                           **kwargs):
+    change_relation_counter(
+        'favorites_count', 'favorites', instance, action, reverse, pk_set
+    )
+
+
+@receiver(m2m_changed, sender=Recipe.groceries_list.through)
+def change_in_carts_count(sender, instance, action, reverse, pk_set,
+                          **kwargs):
+    change_relation_counter(
+        'in_carts_count', 'groceries_list', instance, action, reverse,
+        pk_set,
+    )
+
+
+@receiver(m2m_changed, sender=Recipe.groceries_list.through)
+def apply_cart_changes_to_shopping_lists(sender, instance, action, reverse,
+                                         pk_set, **kwargs):
+    """
+    Переносит в списки покупок изменения корзины через ORM, например
+    в админке. API меняет корзину напрямую SQL и обновляет списки само.
+    Удаление учитывается до удаления связей, по тем из них, которые
+    действительно есть.
+    """
+
+    if action == 'post_add':
+        sign = 1
+    elif action in ('pre_remove', 'pre_clear'):
+        sign = -1
+        if not reverse:
+            lock_recipes([instance.pk])
+        existing = instance.groceries_list.all()
+        if action == 'pre_remove':
+            existing = existing.filter(pk__in=pk_set)
+        pk_set = set(existing.values_list('pk', flat=True))
+    else:
+        return
+    if not pk_set:
+        return
+    if reverse:
+        user_ids, recipe_ids = [instance.pk], pk_set
+    else:
+        user_ids, recipe_ids = list(pk_set), [instance.pk]
+    lock_recipes(recipe_ids)
+    apply_shopping_list_deltas(user_ids, {
+        ingredient_id: (sign * amount, sign * count)
+        for ingredient_id, (amount, count)
+        in get_recipes_totals(recipe_ids).items()
+    })
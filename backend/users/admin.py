@@ -1,10 +1,20 @@
 from django.contrib import admin
 
+from recipes.paginators import EstimatedCountPaginator
+
 from .models import User
 
 
 class UserAdmin(admin.ModelAdmin):
-    list_filter = ('username', 'email',)
+    list_display = (
+        'username', 'email', 'first_name', 'last_name', 'recipes_count',
+        'is_active',
+    )
+    list_filter = ('is_active', 'role')
+    search_fields = ('^username', '^email')
+    ordering = ('id',)
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
 
 
 admin.site.register(User, UserAdmin)
@@ -1,7 +1,121 @@
+import copy
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
 from rest_framework.authentication import (BaseAuthentication,
                                            get_authorization_header)
 from rest_framework.authtoken.models import Token
 from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings
+
+from backend.metrics import AUTH_CACHE_HITS, AUTH_CACHE_MISSES
+
+from .token_deny_list import token_deny_list
+
+
+class UserCache:
+    """
+    LRU кеш пользователей, найденных по токену, с ограниченным временем
+    жизни записей. Ключ это id токена (jti для JWT, key для Token).
+    Версия пользователя хранится в общем кеше, поэтому сброс
+    в одном воркере gunicorn делает записи устаревшими во всех.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def version_key(user_id):
+        return f'auth_user_version:{user_id}'
+
+    def get(self, key):
+        """
+        Возвращает пару из копии пользователя и объекта аутентификации,
+        сохранённого вместе с ним, чтобы изменения пользователя в одном
+        запросе не попадали в кеш и в другие запросы. Если версии
+        пользователя нет в общем кеше, например после вытеснения,
+        запись считается устаревшей.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is not None:
+            user, auth, version, expires_at = entry
+            if (
+                expires_at > time.monotonic()
+                and cache.get(self.version_key(user.pk)) == version
+            ):
+                AUTH_CACHE_HITS.inc()
+                return copy.copy(user), auth
+            with self._lock:
+                self._entries.pop(key, None)
+        AUTH_CACHE_MISSES.inc()
+        return None
+
+    def set(self, key, user, auth=None):
+        """
+        Версия пользователя создаётся, если её ещё нет. Без версии
+        в общем кеше запись не сохраняется: её нельзя было бы сбросить.
+        """
+
+        version_key = self.version_key(user.pk)
+        cache.add(version_key, uuid.uuid4().hex, None)
+        version = cache.get(version_key)
+        if version is None:
+            return
+        entry = (
+            copy.copy(user), auth, version, time.monotonic() + self.ttl
+        )
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate_user(self, user_id):
+        cache.set(self.version_key(user_id), uuid.uuid4().hex, None)
+        with self._lock:
+            for key in [
+                key for key, (user, _, _, _) in self._entries.items()
+                if user.pk == user_id
+            ]:
+                del self._entries[key]
+
+
+user_cache = UserCache(
+    max_size=settings.AUTH_USER_CACHE_SIZE, ttl=settings.AUTH_USER_CACHE_TTL
+)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWT аутентификация, которая не ходит в базу данных за пользователем,
+    если он уже найден по этому токену и не менялся с тех пор.
+    Токены, отозванные при логауте, отклоняются.
+    """
+
+    def get_user(self, validated_token):
+        key = validated_token.get(api_settings.JTI_CLAIM)
+        if key is None:
+            return super().get_user(validated_token)
+        if token_deny_list.is_revoked(key):
+            raise AuthenticationFailed('Токен отозван.', code='token_revoked')
+        cached = user_cache.get(key)
+        if cached is not None:
+            return cached[0]
+        user = super().get_user(validated_token)
+        user_cache.set(key, user)
+        return user
 
 
 class CustomTokenAuthentication(BaseAuthentication):
@@ -33,12 +147,19 @@ class CustomTokenAuthentication(BaseAuthentication):
         return self.authenticate_credentials(token)
 
     def authenticate_credentials(self, key):
+        cached = user_cache.get(key)
+        if cached is not None:
+            user, token = cached
+            token = copy.copy(token)
+            token.user = user
+            return (user, token)
         try:
-            token = Token.objects.get(key=key)
+            token = Token.objects.select_related('user').get(key=key)
         except Token.DoesNotExist:
             raise AuthenticationFailed('Неправильный токен.')
 
         if not token.user.is_active:
             raise AuthenticationFailed('Юзер неактивен или удалён.')
 
+        user_cache.set(key, token.user, copy.copy(token))
         return (token.user, token)
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.16 on 2026-10-18 18:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='subscription',
+            index=models.Index(fields=['subscription', 'user'], name='subscription_author_user_idx'),
+        ),
+    ]
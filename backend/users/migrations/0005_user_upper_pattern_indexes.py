@@ -0,0 +1,47 @@
+# Generated by Django 3.2.16 on 2026-10-18 21:40
+
+from django.db import migrations
+
+INDEXES = (
+    ('user_username_upper_pattern_idx', 'username'),
+    ('user_email_upper_pattern_idx', 'email'),
+)
+
+
+def create_upper_pattern_indexes(apps, schema_editor):
+    """
+    Поиск в админке по '^username' и '^email' это istartswith, он
+    компилируется в UPPER(column::text) LIKE UPPER(%s). Уникальные
+    индексы по самим столбцам такое выражение не обслуживают.
+    Индекс по username нужен и для '=author__username' в админке
+    рецептов: iexact сравнивает те же UPPER.
+    """
+
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    table = apps.get_model('users', 'User')._meta.db_table
+    for name, column in INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX {name} '
+            f'ON {table} (UPPER({column}::text) text_pattern_ops)'
+        )
+
+
+def drop_upper_pattern_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _ in INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_subscription_author_user_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            create_upper_pattern_indexes, drop_upper_pattern_indexes
+        ),
+    ]
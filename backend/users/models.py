@@ -38,6 +38,15 @@ class User(AbstractUser):
         max_length=20,
         verbose_name="Роль",
     )
+    recipes_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name="Количество рецептов",
+    )
+    subscribers_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name="Количество подписчиков",
+    )
+    subscriptions_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name="Количество подписок",
+    )
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['first_name', 'last_name']
 
@@ -48,6 +57,43 @@ class User(AbstractUser):
     def __str__(self):
         return self.username
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        update_fields = kwargs.get('update_fields')
+        self._loaded_values = {
+            **getattr(self, '_loaded_values', {}),
+            **{
+                field.attname: getattr(self, field.attname)
+                for field in self._meta.concrete_fields
+                if update_fields is None or field.name in update_fields
+            },
+        }
+
+    def changed_fields(self, fields):
+        """
+        Поля из fields, значения которых отличаются от прочитанных из базы
+        или записанных последним save. Сигналы post_save видят значения
+        до записи. Для объекта, созданного не из базы, изменены все поля.
+        """
+
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            return set(fields)
+        return {
+            field for field in fields
+            if field not in loaded or loaded[field] != getattr(self, field)
+        }
+
+    @property
+    def is_admin_or_staff(self):
+        return self.role == UserRoles.ADMIN or self.is_staff
+
 
 class Subscription(models.Model):
     subscription = models.ForeignKey(
@@ -61,3 +107,25 @@ class Subscription(models.Model):
         constraints = [
             models.UniqueConstraint(
                 fields=['user', 'subscription'], name='subscriptions_unique')]
+        indexes = [
+            models.Index(
+                fields=['subscription', 'user'],
+                name='subscription_author_user_idx',
+            ),
+        ]
+
+
+class RevokedToken(models.Model):
+    jti = models.CharField(
+        max_length=255, unique=True, verbose_name="Идентификатор токена",
+    )
+    expires_at = models.DateTimeField(
+        db_index=True, verbose_name="Истекает",
+    )
+
+    class Meta:
+        verbose_name = "отозванный токен"
+        verbose_name_plural = "Отозванные токены"
+
+    def __str__(self):
+        return self.jti
@@ -0,0 +1,29 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .authentication import user_cache
+from .models import User
+
+# Поля, от которых зависят аутентификация, права и данные пользователя
+# в ответах API.
+CACHED_FIELDS = (
+    'password', 'is_active', 'is_staff', 'is_superuser', 'role',
+    'email', 'username', 'first_name', 'last_name',
+)
+
+
+@receiver(post_save, sender=User)
+def invalidate_saved_user_cache(sender, instance, created, **kwargs):
+    """
+    Новый пользователь ещё не может быть в кеше, а сохранение без
+    изменений этих полей, например last_login, кеш не сбрасывает.
+    """
+
+    if created or not instance.changed_fields(CACHED_FIELDS):
+        return
+    user_cache.invalidate_user(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def invalidate_deleted_user_cache(sender, instance, **kwargs):
+    user_cache.invalidate_user(instance.pk)
@@ -0,0 +1,224 @@
+import hashlib
+import math
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import RevokedToken
+
+VERSION_CACHE_KEY = 'token_deny_list_version'
+FILTER_CACHE_KEY = 'token_deny_list_filter'
+LOCK_CACHE_KEY = 'token_deny_list_lock'
+LOCK_TIMEOUT = 5
+PUBLISH_ATTEMPTS = 3
+
+
+class BloomFilter:
+    """
+    Фильтр Блума для строк. Отвечает "точно нет" или "возможно да",
+    ложноположительные ответы случаются с вероятностью error_rate.
+    """
+
+    def __init__(self, capacity, error_rate=0.01, bits=None, hashes=None):
+        capacity = max(capacity, 1)
+        size = math.ceil(
+            -capacity * math.log(error_rate) / math.log(2) ** 2
+        )
+        self.size = size
+        self.hashes = hashes or max(
+            1, round(size / capacity * math.log(2))
+        )
+        self.bits = bits or bytearray((size + 7) // 8)
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        for index in range(self.hashes):
+            yield (first + index * second) % self.size
+
+    def add(self, value):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(value)
+        )
+
+
+class TokenDenyList:
+    """
+    Список отозванных токенов по jti. Источник правды это таблица
+    RevokedToken, в памяти процесса лежит фильтр Блума по ней. Фильтр
+    хранится в кеше вместе со своей версией, а копия версии лежит
+    под отдельным маленьким ключом: на каждый запрос читается только
+    она, а биты загружаются, когда версия меняется. При отзыве токена
+    jti добавляется в текущий фильтр, который публикуется с новой
+    версией, остальные воркеры забирают его из кеша. Изменения
+    фильтра в кеше делаются под блокировкой в том же кеше, чтобы
+    параллельные логауты не затирали друг друга. В базу данных запрос
+    идёт только если фильтр ответил "возможно да". Фильтр целиком
+    перестраивается по таблице, когда заполнен или старше
+    TOKEN_DENY_LIST_REBUILD_INTERVAL, тогда же удаляются истёкшие
+    записи.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    @contextmanager
+    def _cache_lock(self):
+        """
+        Блокировка через cache.add. Если её не удалось получить за
+        LOCK_TIMEOUT, владелец скорее всего упал, и работа идёт без
+        неё: блокировка истечёт сама.
+        """
+
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        while (
+            not cache.add(LOCK_CACHE_KEY, token, LOCK_TIMEOUT)
+            and time.monotonic() < deadline
+        ):
+            time.sleep(0.01)
+        try:
+            yield
+        finally:
+            if cache.get(LOCK_CACHE_KEY) == token:
+                cache.delete(LOCK_CACHE_KEY)
+
+    @staticmethod
+    def _timeout(built_at):
+        return max(
+            built_at + settings.TOKEN_DENY_LIST_REBUILD_INTERVAL
+            - time.time(),
+            1,
+        )
+
+    def _store(self, bloom, count, capacity, built_at):
+        """
+        Сначала пишется фильтр, потом его версия: читатель, увидевший
+        новую версию, уже найдёт в кеше и новый фильтр.
+        """
+
+        version = uuid.uuid4().hex
+        timeout = self._timeout(built_at)
+        cache.set(
+            FILTER_CACHE_KEY,
+            (
+                version, bloom.size, bloom.hashes, bytes(bloom.bits),
+                count, capacity, built_at,
+            ),
+            timeout,
+        )
+        cache.set(VERSION_CACHE_KEY, version, timeout)
+        return version, bloom
+
+    def _rebuild(self):
+        RevokedToken.objects.filter(expires_at__lte=timezone.now()).delete()
+        jtis = list(RevokedToken.objects.values_list('jti', flat=True))
+        capacity = max(len(jtis) * 2, settings.TOKEN_DENY_LIST_MIN_CAPACITY)
+        bloom = BloomFilter(capacity)
+        for jti in jtis:
+            bloom.add(jti)
+        return self._store(bloom, len(jtis), capacity, time.time())
+
+    @staticmethod
+    def _unpack(cached):
+        version, size, hashes, bits, *_ = cached
+        bloom = BloomFilter(1, hashes=hashes, bits=bytearray(bits))
+        bloom.size = size
+        return version, bloom
+
+    def _get_snapshot(self):
+        version = cache.get(VERSION_CACHE_KEY)
+        snapshot = self._snapshot
+        if (
+            version is not None
+            and snapshot is not None
+            and snapshot[0] == version
+        ):
+            return snapshot
+        with self._lock:
+            snapshot = self._snapshot
+            if (
+                version is not None
+                and snapshot is not None
+                and snapshot[0] == version
+            ):
+                return snapshot
+            cached = cache.get(FILTER_CACHE_KEY)
+            if cached is None:
+                with self._cache_lock():
+                    cached = cache.get(FILTER_CACHE_KEY)
+                    if cached is None:
+                        self._snapshot = self._rebuild()
+                        return self._snapshot
+            snapshot = self._snapshot = self._unpack(cached)
+            if snapshot[0] != version:
+                # Версия вытеснена или отстала от фильтра, например её
+                # затёрла параллельная запись. Фильтр согласован сам
+                # с собой, поэтому версия восстанавливается по нему.
+                cache.set(
+                    VERSION_CACHE_KEY, snapshot[0],
+                    self._timeout(cached[6]),
+                )
+        return snapshot
+
+    def is_revoked(self, jti):
+        _, bloom = self._get_snapshot()
+        if jti not in bloom:
+            return False
+        return RevokedToken.objects.filter(
+            jti=jti, expires_at__gt=timezone.now()
+        ).exists()
+
+    def revoke(self, jti, expires_at):
+        """
+        Отзывает токен. Фильтр обновляется после коммита транзакции,
+        чтобы при перестроении новая запись уже была видна в базе данных.
+        """
+
+        RevokedToken.objects.bulk_create(
+            [RevokedToken(jti=jti, expires_at=expires_at)],
+            ignore_conflicts=True,
+        )
+        transaction.on_commit(partial(self._publish, jti))
+
+    def _publish(self, jti):
+        """
+        cache.add в FileBasedCache не атомарен, и блокировку могут
+        получить двое. Поэтому после записи фильтр перечитывается,
+        и если jti затёрт параллельной записью, добавляется заново.
+        """
+
+        for _ in range(PUBLISH_ATTEMPTS):
+            with self._cache_lock():
+                cached = cache.get(FILTER_CACHE_KEY)
+                if cached is None or cached[4] >= cached[5]:
+                    snapshot = self._rebuild()
+                else:
+                    _, bloom = self._unpack(cached)
+                    bloom.add(jti)
+                    *_, count, capacity, built_at = cached
+                    snapshot = self._store(
+                        bloom, count + 1, capacity, built_at
+                    )
+            cached = cache.get(FILTER_CACHE_KEY)
+            if cached is None or jti in self._unpack(cached)[1]:
+                break
+        with self._lock:
+            self._snapshot = snapshot
+
+
+token_deny_list = TokenDenyList()